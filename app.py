@@ -1,105 +1,206 @@
 import logging
 import asyncio
+import signal
 import time
-import os
-import json
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------------- Logging ----------------
+# Configured once here, before the bot modules log anything at import time;
+# library modules only create named loggers
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
 from config import STRENGTH_ALERT_COOLDOWN
-from utils import send_telegram
+from utils import (
+    TelegramBatcher, write_json_atomic, read_json_state, report_error, wait_for_shutdown,
+    is_forex_market_open, seconds_until_market_open, shutdown_candle_executor
+)
 from trade_signal import run_trade_signal_loop_async
 from currency_strength import run_currency_strength_alert
-from forex_news_alert import run_news_alert_loop, alerted_events
+from forex_news_alert import run_news_alert_loop
 from breakout import run_group_breakout_alert  # now H4-aligned
 
 # ---------------- Logger ----------------
 logger = logging.getLogger("forex_bot")
 logger.setLevel(logging.INFO)
-logging.basicConfig(format="%(asctime)s [%(levelname)s] %(message)s")
 
 # ---------------- Debug ----------------
 DEBUG_MODE = False
 
 # ---------------- Cooldown Trackers ----------------
-last_trade_alert_times = {}
+last_trade_alert_times = {}  # {alert_kind: {pair: last_alert_ts}}
 last_heartbeat_time = 0
 HEARTBEAT_COOLDOWN = 24 * 3600
+HEARTBEAT_RETRY = 60            # retry a failed heartbeat after 1 minute
+GROUP_BREAKOUT_INTERVAL = 60    # H4 group breakout scan cadence
+AUTOSAVE_INTERVAL = 300         # persist state every 5 minutes
+JOB_ERROR_RETRY = 60            # rerun a job that raised after 1 minute
+ALERT_TIMES_RETENTION = 7 * 24 * 3600  # cooldown entries older than this are dropped
 STATE_FILE = "bot_state.json"
+# Worker threads behind asyncio.to_thread: the trade loop, news loop, strength job,
+# breakout scan, autosave and Telegram sends (candle fan-out has its own pool in utils)
+WORKER_THREADS = 8
+_last_saved_state = None  # last snapshot written, to skip unchanged autosaves
 
 # ---------------- Graceful Shutdown ----------------
 shutdown_event = asyncio.Event()
 
+# ---------------- Telegram Batching ----------------
+telegram_batcher = TelegramBatcher()
+
 # ---------------- Load State on Startup ----------------
-if os.path.exists(STATE_FILE):
-    try:
-        with open(STATE_FILE, "r") as f:
-            state = json.load(f)
-            last_trade_alert_times.update(state.get("last_trade_alert_times", {}))
-            alerted_events.update(state.get("alerted_events", []))
+def parse_alert_times(raw) -> dict:
+    """Coerce persisted {kind: {pair: ts}} into floats, dropping malformed entries."""
+    parsed = {}
+    for kind, times in (raw or {}).items():
+        if not isinstance(times, dict):
+            continue  # pre-partition format; nothing usable to restore
+        for pair, ts in times.items():
+            try:
+                parsed.setdefault(kind, {})[pair] = float(ts)
+            except (TypeError, ValueError):
+                continue
+    return parsed
+
+try:
+    state = read_json_state(STATE_FILE)
+    if state is not None:
+        last_trade_alert_times.update(parse_alert_times(state.get("last_trade_alert_times")))
         logger.info("✅ Restored bot state from bot_state.json")
-    except Exception as e:
-        logger.error(f"Failed to restore bot state: {e}", exc_info=True)
+except Exception as e:
+    logger.error(f"Failed to restore bot state: {e}", exc_info=True)
 
 # ---------------- Save State ----------------
-def save_state():
+def prune_alert_times(max_age: float = ALERT_TIMES_RETENTION):
+    """Drop cooldown entries long past any cooldown so the state stays bounded."""
+    cutoff = time.time() - max_age
+    # Empty kind dicts stay: a worker thread may hold one from setdefault() and
+    # write to it after this runs, which must not land in a detached dict
+    for times in list(last_trade_alert_times.values()):
+        for pair, ts in list(times.items()):
+            if ts < cutoff:
+                times.pop(pair, None)
+
+def save_state(force: bool = False):
+    """Persist cooldown state; unchanged snapshots are skipped unless forced."""
+    global _last_saved_state
     try:
+        prune_alert_times()
+        # alerted_events live in their own append-only log (forex_news_alert)
         state = {
-            "last_trade_alert_times": last_trade_alert_times,
-            "alerted_events": list(alerted_events)
+            "last_trade_alert_times": {
+                kind: {pair: float(ts) for pair, ts in list(times.items())}
+                for kind, times in list(last_trade_alert_times.items())
+            },
         }
-        with open(STATE_FILE, "w") as f:
-            json.dump(state, f, default=str)
+        if not force and state == _last_saved_state:
+            return
+        write_json_atomic(STATE_FILE, state)
+        _last_saved_state = state
         logger.info("💾 Bot state saved successfully")
     except Exception as e:
         logger.error(f"Failed to save bot state: {e}", exc_info=True)
 
-# ---------------- Heartbeat Loop ----------------
-async def send_heartbeat_loop():
+# ---------------- Scheduled Jobs ----------------
+# Each job returns the number of seconds until it should run again.
+async def heartbeat_job():
     global last_heartbeat_time
-    if await asyncio.to_thread(send_telegram, "💓 Bot Heartbeat: Forex bot is running"):
-        logger.info("✅ Sent initial Bot Heartbeat alert")
+    # Sleep straight through to the next heartbeat; every start sends one right away
+    remaining = last_heartbeat_time + HEARTBEAT_COOLDOWN - time.time()
+    if remaining > 0:
+        return remaining
+    if await telegram_batcher.enqueue("💓 Bot Heartbeat: Forex bot is running", key="heartbeat"):
+        logger.info("✅ Sent Bot Heartbeat alert")
         last_heartbeat_time = time.time()
-    while not shutdown_event.is_set():
-        now = time.time()
-        if now - last_heartbeat_time >= HEARTBEAT_COOLDOWN:
-            if await asyncio.to_thread(send_telegram, "💓 Bot Heartbeat: Forex bot is running"):
-                logger.info("✅ Sent daily Bot Heartbeat alert")
-                last_heartbeat_time = now
-        await asyncio.sleep(60)
-
-# ---------------- Currency Strength Loop ----------------
-async def currency_strength_loop():
-    while not shutdown_event.is_set():
-        try:
-            await asyncio.to_thread(run_currency_strength_alert, last_trade_alert_times)
-        except Exception as e:
-            logger.error(f"Unexpected error in currency strength loop: {e}", exc_info=True)
-        await asyncio.sleep(STRENGTH_ALERT_COOLDOWN)
+        return HEARTBEAT_COOLDOWN
+    return HEARTBEAT_RETRY
 
-# ---------------- Group Breakout Loop (H4) ----------------
-async def group_breakout_loop_h4():
+async def currency_strength_job():
+    try:
+        await asyncio.to_thread(
+            run_currency_strength_alert, last_trade_alert_times, telegram_batcher.send_threadsafe
+        )
+    except Exception as e:
+        report_error("currency_strength", e)
+    return STRENGTH_ALERT_COOLDOWN
+
+async def group_breakout_job_h4():
+    if not is_forex_market_open():
+        # Weekend: no scans until the Sunday reopen
+        return max(GROUP_BREAKOUT_INTERVAL, seconds_until_market_open())
+    try:
+        await asyncio.to_thread(
+            run_group_breakout_alert,
+            send_alert_fn=telegram_batcher.send_threadsafe,
+            last_alert_times=last_trade_alert_times,
+        )
+    except Exception as e:
+        report_error("group_breakout_h4", e)
+    return GROUP_BREAKOUT_INTERVAL
+
+async def autosave_job():
+    # save_state() writes atomically, so it can't tear against the shutdown save
+    await asyncio.to_thread(save_state)
+    return AUTOSAVE_INTERVAL
+
+SCHEDULED_JOBS = {
+    "heartbeat": heartbeat_job,
+    "currency_strength": currency_strength_job,
+    "group_breakout_h4": group_breakout_job_h4,
+    "autosave": autosave_job,
+}
+
+# ---------------- Scheduler ----------------
+async def run_job(name: str, job):
+    """Run one job on its own deadline; an uncaught failure is reported and retried."""
     while not shutdown_event.is_set():
         try:
-            await asyncio.to_thread(run_group_breakout_alert)
+            delay = await job()
         except Exception as e:
-            logger.error(f"Unexpected error in H4 group breakout loop: {e}", exc_info=True)
-        await asyncio.sleep(60)
+            report_error(name, e)
+            delay = JOB_ERROR_RETRY
+        if await wait_for_shutdown(shutdown_event, delay):
+            break
+
+async def scheduler(jobs: dict):
+    """
+    Run each job as its own task sleeping exactly until its next deadline,
+    so a slow strength pass can't hold back group scans or autosave.
+    """
+    await asyncio.gather(*(run_job(name, job) for name, job in jobs.items()))
 
-# ---------------- Trade Signal Loop ----------------
-async def trade_signal_loop():
-    await run_trade_signal_loop_async(debug=DEBUG_MODE)
+# ---------------- Signal Handling ----------------
+def request_shutdown(sig_name: str):
+    logger.info(f"🛑 Received {sig_name}, stopping bot...")
+    shutdown_event.set()
+
+def install_signal_handlers():
+    """Turn SIGTERM (e.g. a Heroku dyno restart) and SIGINT into a graceful shutdown."""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, request_shutdown, sig.name)
+        except (NotImplementedError, RuntimeError):
+            pass  # not supported on this platform; KeyboardInterrupt still works
 
 # ---------------- Main ----------------
 async def main():
     logger.info("🚀 Forex bot started")
+    install_signal_handlers()
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=WORKER_THREADS, thread_name_prefix="forex")
+    )
+    telegram_batcher.start()
 
     tasks = [
-        asyncio.create_task(trade_signal_loop()),
-        asyncio.create_task(run_news_alert_loop(shutdown_event)),
-        asyncio.create_task(currency_strength_loop()),
-        asyncio.create_task(group_breakout_loop_h4()),
-        asyncio.create_task(send_heartbeat_loop())
+        asyncio.create_task(run_trade_signal_loop_async(
+            DEBUG_MODE, shutdown_event, last_trade_alert_times, send_alert_fn=telegram_batcher.send_threadsafe
+        )),
+        asyncio.create_task(run_news_alert_loop(shutdown_event, send_alert_fn=telegram_batcher.send_threadsafe)),
+        asyncio.create_task(scheduler(SCHEDULED_JOBS))
     ]
 
     try:
+        # Loops return on their own once shutdown_event is set by a signal handler
         await asyncio.gather(*tasks)
     except (asyncio.CancelledError, KeyboardInterrupt):
         logger.info("🛑 Shutdown signal received, stopping bot...")
@@ -107,8 +208,11 @@ async def main():
         for t in tasks:
             t.cancel()
         await asyncio.gather(*tasks, return_exceptions=True)
-        save_state()
-        logger.info("🟢 Bot stopped gracefully.")
+
+    await telegram_batcher.stop()
+    shutdown_candle_executor()
+    save_state(force=True)
+    logger.info("🟢 Bot stopped gracefully.")
 
 # ---------------- Entry Point ----------------
 if __name__ == "__main__":
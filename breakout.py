@@ -1,107 +1,221 @@
 import logging
 import time
-from utils import get_recent_candles, calculate_ema
-from config import PAIRS
+import numpy as np
+from utils import get_recent_candles, get_recent_candles_batch, calculate_ema, is_forex_market_open
+from config import CURRENCY_GROUPS
 
 logger = logging.getLogger("breakout")
+logger.addHandler(logging.NullHandler())
 logger.setLevel(logging.WARNING)
 
-# --- Currency groups ---
-RAW_CURRENCY_GROUPS = {
-    "USD": ["EUR_USD","GBP_USD","USD_JPY","AUD_USD","NZD_USD","USD_CAD","USD_CHF"],
-    "EUR": ["EUR_USD","EUR_GBP","EUR_JPY","EUR_AUD","EUR_CAD","EUR_NZD"],
-    "GBP": ["GBP_USD","EUR_GBP","GBP_JPY","GBP_AUD","GBP_CAD","GBP_NZD"],
-    "JPY": ["USD_JPY","EUR_JPY","GBP_JPY","AUD_JPY","NZD_JPY","CAD_JPY","CHF_JPY"],
-    "AUD": ["AUD_USD","EUR_AUD","GBP_AUD","AUD_JPY","AUD_NZD","AUD_CAD","AUD_CHF"],
-    "NZD": ["NZD_USD","EUR_NZD","GBP_NZD","AUD_NZD","NZD_JPY","NZD_CAD","NZD_CHF"],
-    "CAD": ["USD_CAD","EUR_CAD","GBP_CAD","AUD_CAD","NZD_CAD","CAD_JPY","CAD_CHF"],
-    "CHF": ["USD_CHF","EUR_CHF","GBP_CHF","AUD_CHF","NZD_CHF","CAD_CHF","CHF_JPY"],
-}
+def configure(level=logging.WARNING):
+    """Set breakout verbosity (e.g. logging.DEBUG for per-pair high/low traces)."""
+    logger.setLevel(level)
 
-CURRENCY_GROUPS = {cur: [p for p in pairs if p in PAIRS] for cur, pairs in RAW_CURRENCY_GROUPS.items()}
+# Inverted index: pair -> groups it belongs to (e.g. EUR_USD -> USD, EUR)
+PAIR_TO_GROUPS = {}
+for _group, _pairs in CURRENCY_GROUPS.items():
+    for _pair in _pairs:
+        PAIR_TO_GROUPS.setdefault(_pair, []).append(_group)
+
+# Every pair that belongs to at least one group, in first-seen order
+GROUP_PAIRS = tuple(PAIR_TO_GROUPS)
+
+# Candle windows used by the H4 breakout test
+H4_WINDOW = 50
+D1_WINDOW = 250
+
+# Breakout results are reused by every caller within the same tick
+BREAKOUT_TICK_SECONDS = 60
+_breakout_results = {}  # pair -> (tick, result), filled by single and batched checks
 
 # Per-group cooldown tracking
-_last_group_alerts = {}  # key = group, value = last alert timestamp
+_last_group_alerts = {}  # key = group, value = last alert time (time.time())
 GROUP_COOLDOWN = 4 * 3600  # 4 hours cooldown
 
+# ----------------- D1 EMA200 memo -----------------
+# Closed D1 bars only change once a day, so the EMA over them is kept per pair
+# and each check folds in just the still-forming bar.
+D1_EMA_PERIOD = 200
+_d1_closed_ema = {}  # pair -> ((first bar time, last closed bar time), ema over closed bars)
+
+def d1_ema(pair, candles_d1, closes_d1, period=D1_EMA_PERIOD):
+    """calculate_ema(closes_d1, period), reusing the closed-bar prefix between checks."""
+    if len(closes_d1) <= period:
+        return calculate_ema(closes_d1, period)
+    window_key = (candles_d1[0].get("time"), candles_d1[-2].get("time"))
+    if None in window_key:
+        return calculate_ema(closes_d1, period)
+    cached = _d1_closed_ema.get(pair)
+    if cached is None or cached[0] != window_key:
+        cached = (window_key, calculate_ema(closes_d1[:-1], period))
+        _d1_closed_ema[pair] = cached
+    prev_ema = cached[1]
+    return (float(closes_d1[-1]) - prev_ema) * (2 / (period + 1)) + prev_ema
+
 # ----------------- Individual H4 breakout check -----------------
 def check_breakout_h4(pair):
     """
     Check if the latest H4 candle breaks recent support/resistance.
     Returns True if breakout occurs, False otherwise.
+    Results are cached for BREAKOUT_TICK_SECONDS, so the group scan,
+    strength alert and trade signal loops share one check per pair.
     """
+    tick = _current_tick()
+    cached = _breakout_results.get(pair)
+    if cached is not None and cached[0] == tick:
+        return cached[1]
+    result = _check_breakout_h4(pair)
+    _breakout_results[pair] = (tick, result)
+    return result
+
+def _current_tick():
+    return int(time.time() // BREAKOUT_TICK_SECONDS)
+
+def _check_breakout_h4(pair):
     try:
-        candles_4h = get_recent_candles(pair, "H4", 50)
-        if not candles_4h or len(candles_4h) < 2:
-            return False
-
-        closes = [float(c["close"]) for c in candles_4h]
-        highs = [float(c["high"]) for c in candles_4h]
-        lows = [float(c["low"]) for c in candles_4h]
-
-        last_close = closes[-1]
-
-        # Recent H4 high/low
-        recent_high = max(highs[-50:])
-        recent_low = min(lows[-50:])
-
-        # ---------------- Safe D1 EMA Trend ----------------
-        candles_d1 = get_recent_candles(pair, "D1", 250)
-        if not candles_d1 or len(candles_d1) < 200:
-            d1_trend_up = d1_trend_down = True  # Assume neutral if not enough D1 data
-        else:
-            closes_d1 = [float(c["close"]) for c in candles_d1]
-            ema_200_d1 = calculate_ema(closes_d1, period=200)
-            if ema_200_d1 is None:
-                d1_trend_up = d1_trend_down = True
-            else:
-                d1_trend_up = closes_d1[-1] > ema_200_d1
-                d1_trend_down = closes_d1[-1] < ema_200_d1
-
-        # Only trigger if breakout aligns with D1 trend
-        if last_close > recent_high and d1_trend_up:
-            return True
-        elif last_close < recent_low and d1_trend_down:
-            return True
-
+        direction = h4_breakout_direction(pair, get_recent_candles(pair, "H4", H4_WINDOW))
+        if direction is None:
+            return False  # no H4 break: skip the D1 fetch and EMA entirely
+        return d1_trend_allows(pair, direction, get_recent_candles(pair, "D", D1_WINDOW))
+    except Exception as e:
+        logger.error("%s H4 breakout check error: %s", pair, e)
         return False
 
+def h4_breakout_direction(pair, candles_4h):
+    """Return "up"/"down" if the last H4 close breaks the recent range, else None."""
+    if not candles_4h or len(candles_4h) < 2:
+        return None
+
+    # One (N, 3) float64 buffer of high/low/close instead of three Python lists
+    ohlc = np.array([(c["high"], c["low"], c["close"]) for c in candles_4h], dtype=np.float64)
+    highs, lows, closes = ohlc[:, 0], ohlc[:, 1], ohlc[:, 2]
+
+    last_close = float(closes[-1])
+
+    # Recent H4 high/low
+    recent_high = float(highs[-50:].max())
+    recent_low = float(lows[-50:].min())
+
+    logger.debug("%s - Current: %s H/L: %s/%s", pair, last_close, recent_high, recent_low)
+
+    if last_close > recent_high:
+        return "up"
+    if last_close < recent_low:
+        return "down"
+    return None
+
+def d1_trend_allows(pair, direction, candles_d1):
+    """Only let a breakout through if it aligns with the D1 EMA200 trend."""
+    # ---------------- Safe D1 EMA Trend ----------------
+    if not candles_d1 or len(candles_d1) < 200:
+        return True  # Assume neutral if not enough D1 data
+    closes_d1 = np.fromiter((c["close"] for c in candles_d1), dtype=np.float64, count=len(candles_d1))
+    ema_200_d1 = d1_ema(pair, candles_d1, closes_d1)
+    if ema_200_d1 is None:
+        return True
+    last_close_d1 = float(closes_d1[-1])  # plain float/bool out, not NumPy scalars
+    if direction == "up":
+        return last_close_d1 > ema_200_d1
+    return last_close_d1 < ema_200_d1
+
+# ----------------- Batched H4 breakout checks -----------------
+def check_breakouts_h4(pairs):
+    """
+    Check many pairs at once: prefetch the H4 window for every pair in one
+    fan-out, then fetch D1 only for pairs that broke out.
+    Results are recorded for the current tick, so later check_breakout_h4
+    calls (e.g. from the strength alert) reuse them.
+    """
+    tick = _current_tick()
+    # Fetch failures already come back as empty lists (no breakout)
+    candles_4h = get_recent_candles_batch(pairs, "H4", H4_WINDOW)
+    results = {pair: False for pair in pairs}
+    directions = {}
+    for pair in pairs:
+        direction = _no_breakout_on_error(h4_breakout_direction, pair, candles_4h[pair])
+        if direction is not None:
+            directions[pair] = direction
+
+    candles_d1 = get_recent_candles_batch(directions, "D", D1_WINDOW)
+    for pair, direction in directions.items():
+        results[pair] = _no_breakout_on_error(d1_trend_allows, pair, direction, candles_d1[pair]) is True
+    for pair, result in results.items():
+        _breakout_results[pair] = (tick, result)
+    return results
+
+def _no_breakout_on_error(check, pair, *args):
+    """Run one pair's check within a batch; a failure means "no breakout" (None), not a failed scan."""
+    try:
+        return check(pair, *args)
     except Exception as e:
-        logger.error(f"{pair} H4 breakout check error: {e}")
-        return False
+        logger.error("%s H4 breakout check error: %s", pair, e)
+        return None
 
 # ----------------- Group breakout alert -----------------
-def run_group_breakout_alert(min_pairs=4, send_alert_fn=None):
+def group_pairs_to_check(min_pairs=4, last_alert_times=None):
+    """
+    Pairs that can still contribute to an alert: members of a group that is
+    large enough to reach `min_pairs` and isn't in its cooldown.
+    """
+    now = time.time()
+    group_times = (
+        last_alert_times.get("group_breakout", {}) if last_alert_times is not None
+        else _last_group_alerts
+    )
+    eligible = {
+        group for group, pairs in CURRENCY_GROUPS.items()
+        if len(pairs) >= min_pairs and now - group_times.get(group, 0) >= GROUP_COOLDOWN
+    }
+    return tuple(pair for pair in GROUP_PAIRS if eligible.intersection(PAIR_TO_GROUPS[pair]))
+
+def run_group_breakout_alert(min_pairs=4, send_alert_fn=None, breakout_results=None,
+                             last_alert_times=None):
     """
     Check for H4 breakout alerts per currency group.
-    Each group has a 4-hour cooldown.
+    Each group has a 4-hour cooldown. Pass the application's persisted
+    `last_alert_times` ({kind: {key: ts}}) so cooldowns survive restarts;
+    otherwise they are tracked in memory only.
+    `breakout_results` may carry precomputed pair -> bool checks; otherwise
+    the pairs of groups that can still alert are checked with one batched
+    H4 and D1 prefetch (check_breakouts_h4).
+    Nothing is checked while the FX market is closed for the weekend.
     Returns a dict of groups with breakout pairs.
     """
-    global _last_group_alerts
+    if not is_forex_market_open():
+        return {}
+    if breakout_results is None:
+        breakout_results = check_breakouts_h4(group_pairs_to_check(min_pairs, last_alert_times))
+    # Wall clock, since these timestamps are persisted across restarts
     now = time.time()
+    group_times = (
+        last_alert_times.setdefault("group_breakout", {}) if last_alert_times is not None
+        else _last_group_alerts
+    )
     alerts = {}
+    messages = []
 
-    for group, pairs in CURRENCY_GROUPS.items():
-        breakout_pairs = []
-
-        for pair in pairs:
-            try:
-                if check_breakout_h4(pair):
-                    breakout_pairs.append(pair)
-            except Exception as e:
-                logger.error(f"{pair} group breakout check error: {e}")
+    # Scatter each pair's single result into every group it belongs to
+    group_breakouts = {}
+    for pair in GROUP_PAIRS:
+        if breakout_results.get(pair):
+            for group in PAIR_TO_GROUPS[pair]:
+                group_breakouts.setdefault(group, []).append(pair)
 
+    for group, breakout_pairs in group_breakouts.items():
         # Only send alert if enough pairs broke out and cooldown passed
         if len(breakout_pairs) >= min_pairs:
-            last_ts = _last_group_alerts.get(group, 0)
+            last_ts = group_times.get(group, 0)
             if now - last_ts >= GROUP_COOLDOWN:
                 alerts[group] = breakout_pairs
-                _last_group_alerts[group] = now
-                if send_alert_fn:
-                    msg = (
-                        f"📢 {group} Group H4 Breakout Alert! ({len(breakout_pairs)} pairs)\n"
-                        + "\n".join(sorted(breakout_pairs))
-                    )
-                    send_alert_fn(msg)
+                group_times[group] = now
+                messages.append(
+                    f"📢 {group} Group H4 Breakout Alert! ({len(breakout_pairs)} pairs)\n"
+                    + "\n".join(sorted(breakout_pairs))
+                )
+
+    # One Telegram message per scan, however many groups fired (8 groups stay well under 4096 chars)
+    if send_alert_fn and messages:
+        send_alert_fn("\n\n".join(messages))
 
     return alerts
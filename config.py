@@ -59,8 +59,30 @@ DEFAULT_PAIRS = [
 ]
 
 # Use environment variable if set, otherwise default list
-PAIRS = os.getenv("PAIRS", ",".join(DEFAULT_PAIRS)).split(",")
-PAIRS = [p.strip() for p in PAIRS]
+# Ordered tuple for iteration, frozenset for membership
+PAIRS = tuple(p.strip() for p in os.getenv("PAIRS", ",".join(DEFAULT_PAIRS)).split(",") if p.strip())
+
+# O(1) membership checks
+PAIRS_SET = frozenset(PAIRS)
+# pair -> (base, quote), split once instead of on every scan
+PAIR_CURRENCIES = {p: tuple(p.split("_")) for p in PAIRS if p.count("_") == 1}
+
+# --- Currency groups for group breakout alerts ---
+RAW_CURRENCY_GROUPS = {
+    "USD": ("EUR_USD","GBP_USD","USD_JPY","AUD_USD","NZD_USD","USD_CAD","USD_CHF"),
+    "EUR": ("EUR_USD","EUR_GBP","EUR_JPY","EUR_AUD","EUR_CAD","EUR_NZD"),
+    "GBP": ("GBP_USD","EUR_GBP","GBP_JPY","GBP_AUD","GBP_CAD","GBP_NZD"),
+    "JPY": ("USD_JPY","EUR_JPY","GBP_JPY","AUD_JPY","NZD_JPY","CAD_JPY","CHF_JPY"),
+    "AUD": ("AUD_USD","EUR_AUD","GBP_AUD","AUD_JPY","AUD_NZD","AUD_CAD","AUD_CHF"),
+    "NZD": ("NZD_USD","EUR_NZD","GBP_NZD","AUD_NZD","NZD_JPY","NZD_CAD","NZD_CHF"),
+    "CAD": ("USD_CAD","EUR_CAD","GBP_CAD","AUD_CAD","NZD_CAD","CAD_JPY","CAD_CHF"),
+    "CHF": ("USD_CHF","EUR_CHF","GBP_CHF","AUD_CHF","NZD_CHF","CAD_CHF","CHF_JPY"),
+}
+
+# Groups restricted to the monitored PAIRS, built once at import
+CURRENCY_GROUPS = {
+    cur: tuple(p for p in pairs if p in PAIRS_SET) for cur, pairs in RAW_CURRENCY_GROUPS.items()
+}
 
 # --- Alert cooldowns in seconds ---
 ALERT_COOLDOWN = 4 * 3600           # general breakout alerts (1 hour)
@@ -1,74 +1,102 @@
 import logging
 import time
+from functools import lru_cache
 from threading import Lock
-from config import PAIRS, STRENGTH_ALERT_COOLDOWN
-from utils import get_recent_candles, rsi, ema_slope, atr, send_telegram
+from config import PAIRS_SET, PAIR_CURRENCIES, STRENGTH_ALERT_COOLDOWN
+from utils import get_recent_candles_batch, rsi, ema_slope, atr, send_telegram
 from breakout import check_breakout_h4  # updated to H4
 
 logger = logging.getLogger("currency_strength")
+logger.addHandler(logging.NullHandler())
 logger.setLevel(logging.INFO)
-logging.basicConfig(level=logging.INFO)
 
 CURRENCIES = ["EUR", "GBP", "USD", "JPY", "CHF", "AUD", "NZD", "CAD"]
+CURRENCIES_SET = frozenset(CURRENCIES)
+
+# Pairs that feed the ranking, resolved once from config's pre-split (base, quote) map
+RANKED_PAIRS = {
+    pair: (base, quote)
+    for pair, (base, quote) in PAIR_CURRENCIES.items()
+    if base in CURRENCIES_SET and quote in CURRENCIES_SET
+}
 
 # ---------------- Thread-Safe Cooldown ----------------
 _strength_alert_lock = Lock()
-_last_strength_alert_time = 0
+_last_strength_alert_time = float("-inf")  # time.monotonic() of the last full alert
 
 # ---------------- Core Strength Calculation ----------------
+W_PRICE, W_RSI, W_EMA, W_ATR = 0.4, 0.3, 0.2, 0.1  # score weights
+MAX_RANK, MIN_RANK = 7, -7
+
+@lru_cache(maxsize=None)
+def rank_ladder(n: int) -> tuple:
+    """Ranks by position for n scored currencies: (7, 5, 3, 1, -1, -3, -5, -7) when all 8 score."""
+    if n < 2:
+        return (MAX_RANK,) * n
+    ladder = []
+    for idx in range(n):
+        rank = int(round(MAX_RANK - (idx * (MAX_RANK - MIN_RANK) / (n - 1))))
+        if rank == 0:
+            rank = 1 if idx < n / 2 else -1
+        ladder.append(rank)
+    return tuple(ladder)
+
 def calculate_strength():
-    scores = {c: [] for c in CURRENCIES}
+    # Running totals per currency instead of a list of scores each
+    totals = dict.fromkeys(CURRENCIES, 0.0)
+    counts = dict.fromkeys(CURRENCIES, 0)
 
-    for pair in PAIRS:
-        if "_" not in pair:
-            continue
-        base, quote = pair.split("_")
-        if base not in CURRENCIES or quote not in CURRENCIES:
-            continue
+    # Fetch every ranked pair's H4 candles in one pass
+    candles_map = get_recent_candles_batch(RANKED_PAIRS, "H4", 20)
 
-        candles = get_recent_candles(pair, "H4", 20)
+    for pair, (base, quote) in RANKED_PAIRS.items():
+        candles = candles_map.get(pair)
         if not candles:
             continue
 
-        closes = [float(c["close"]) for c in candles]
+        closes = [c["close"] for c in candles]
         price_change = ((closes[-1] - closes[-2]) / closes[-2]) * 100 if len(closes) >= 2 else 0
-        rsi_val = rsi(closes)[-1] if rsi(closes) else 0
+        rsi_values = rsi(closes)
+        rsi_val = rsi_values[-1] if rsi_values else 0
         ema_trend = ema_slope(closes)
         atr_val = atr(candles) or 0
 
-        w_price, w_rsi, w_ema, w_atr = 0.4, 0.3, 0.2, 0.1
         norm_rsi = (rsi_val - 50) / 50
-        score_base = w_price * price_change + w_rsi * norm_rsi * 100 + w_ema * ema_trend * 100 + w_atr * atr_val
+        score_base = W_PRICE * price_change + W_RSI * norm_rsi * 100 + W_EMA * ema_trend * 100 + W_ATR * atr_val
 
-        scores[base].append(score_base)
-        scores[quote].append(-score_base)
+        totals[base] += score_base
+        totals[quote] -= score_base
+        counts[base] += 1
+        counts[quote] += 1
 
-    avg_scores = {cur: sum(vals)/len(vals) for cur, vals in scores.items() if vals}
+    avg_scores = {cur: totals[cur] / n for cur, n in counts.items() if n}
 
-    sorted_scores = sorted(avg_scores.items(), key=lambda x: x[1], reverse=True)
-    n = len(sorted_scores)
-    max_rank, min_rank = 7, -7
-    rank_map = {}
-    for idx, (cur, _) in enumerate(sorted_scores):
-        rank = int(round(max_rank - (idx * (max_rank - min_rank) / (n - 1))))
-        if rank == 0:
-            rank = 1 if idx < n / 2 else -1
-        rank_map[cur] = rank
+    # Strongest first; ranks are assigned by position from a per-size ladder
+    ranked = sorted(avg_scores, key=avg_scores.get, reverse=True)
+    return dict(zip(ranked, rank_ladder(len(ranked))))
+
+# ---------------- Per-Tick Memoization ----------------
+STRENGTH_TICK_SECONDS = 60  # rankings are recomputed at most once per tick
 
-    # Ensure integers
-    for cur in rank_map:
-        rank_map[cur] = int(rank_map[cur])
+@lru_cache(maxsize=2)
+def _calculate_strength_for_tick(tick: int):
+    return calculate_strength()
 
-    return rank_map
+def calculate_strength_cached():
+    """calculate_strength(), computed at most once per STRENGTH_TICK_SECONDS."""
+    return dict(_calculate_strength_for_tick(int(time.time() // STRENGTH_TICK_SECONDS)))
 
 # ---------------- Formatting ----------------
 def format_strength_alert(rank_map):
-    msg = "📊 Currency Strength Alert 📊\n"
-    msg += "Currency Strength Rankings (+7 strongest → -7 weakest):\n"
-    for cur, rank in sorted(rank_map.items(), key=lambda x: x[1], reverse=True):
-        sign = "+" if rank > 0 else ""
-        msg += f"{cur}: {sign}{rank}\n"
-    return msg
+    lines = [
+        "📊 Currency Strength Alert 📊",
+        "Currency Strength Rankings (+7 strongest → -7 weakest):",
+    ]
+    lines.extend(
+        f"{cur}: {'+' if rank > 0 else ''}{rank}"
+        for cur, rank in sorted(rank_map.items(), key=lambda x: x[1], reverse=True)
+    )
+    return "\n".join(lines) + "\n"
 
 # ---------------- Strength Filter ----------------
 def strength_filter(strong_val, weak_val):
@@ -82,41 +110,49 @@ def strength_filter(strong_val, weak_val):
     )
 
 # ---------------- Runner ----------------
-def run_currency_strength_alert(last_trade_alert_times: dict = None):
+def run_currency_strength_alert(last_trade_alert_times: dict = None, send_alert_fn=send_telegram):
     global _last_strength_alert_time
-    now_ts = time.time()
+    now_ts = time.time()        # wall clock, persisted in last_trade_alert_times
+    now_mono = time.monotonic()  # cooldown arithmetic, immune to clock steps
 
     with _strength_alert_lock:
         # Cooldown check
-        if now_ts - _last_strength_alert_time < STRENGTH_ALERT_COOLDOWN:
-            rank_map = calculate_strength()
+        if now_mono - _last_strength_alert_time < STRENGTH_ALERT_COOLDOWN:
+            rank_map = calculate_strength_cached()
             return rank_map, _last_strength_alert_time
 
         try:
-            rank_map = calculate_strength()
+            rank_map = calculate_strength_cached()
             if not rank_map:
                 return {}, _last_strength_alert_time
 
             # Send full ranking alert
             alert_msg = format_strength_alert(rank_map)
-            if send_telegram(alert_msg):
+            if send_alert_fn(alert_msg):
                 logger.info("✅ Sent full currency strength alert")
-                _last_strength_alert_time = now_ts
+                _last_strength_alert_time = now_mono
 
             # Filter strong/weak currencies
             filtered_currencies = {cur: int(val) for cur, val in rank_map.items() if abs(val) >= 5}
 
             # Determine top candidate pair
             if filtered_currencies and last_trade_alert_times is not None:
+                # Only pairs of one strong-positive and one strong-negative currency can pass
+                # strength_filter, so build those directly instead of scanning every pair
+                positive = [cur for cur, val in filtered_currencies.items() if val > 0]
+                negative = [cur for cur, val in filtered_currencies.items() if val < 0]
+                opposing_pairs = [
+                    pair
+                    for pos in positive for neg in negative
+                    for pair in (f"{pos}_{neg}", f"{neg}_{pos}")
+                    if pair in PAIRS_SET
+                ]
+
                 candidate_pairs = []
-                for pair in PAIRS:
-                    if "_" not in pair:
-                        continue
-                    base, quote = pair.split("_")
-                    base_val = filtered_currencies.get(base)
-                    quote_val = filtered_currencies.get(quote)
-                    if base_val is None or quote_val is None:
-                        continue
+                for pair in opposing_pairs:
+                    base, quote = PAIR_CURRENCIES[pair]
+                    base_val = filtered_currencies[base]
+                    quote_val = filtered_currencies[quote]
 
                     strong_val, weak_val = (base_val, quote_val) if abs(base_val) >= abs(quote_val) else (quote_val, base_val)
                     if not strength_filter(strong_val, weak_val):
@@ -134,11 +170,12 @@ def run_currency_strength_alert(last_trade_alert_times: dict = None):
                 if candidate_pairs:
                     _, pair, base_val, quote_val = candidate_pairs[0]
                     signal_type = "BUY" if base_val > quote_val else "SELL"
-                    key = (pair, "strength_alert")
-                    last_pair_ts = last_trade_alert_times.get(key, 0)
+                    # Cooldowns are partitioned by alert kind: {kind: {pair: ts}}
+                    pair_times = last_trade_alert_times.setdefault("strength_alert", {})
+                    last_pair_ts = pair_times.get(pair, 0)
                     if now_ts - last_pair_ts >= STRENGTH_ALERT_COOLDOWN:
-                        last_trade_alert_times[key] = now_ts
-                        logger.info(f"💹 Top Candidate Trade Alert: {signal_type} {pair} | Strength Diff: {abs(base_val - quote_val)}")
+                        pair_times[pair] = now_ts
+                        logger.info("💹 Top Candidate Trade Alert: %s %s | Strength Diff: %d", signal_type, pair, abs(base_val - quote_val))
 
             return filtered_currencies, _last_strength_alert_time
 
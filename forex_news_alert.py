@@ -2,50 +2,205 @@ import logging
 import datetime
 import requests
 import asyncio
-from threading import Lock
-from utils import send_telegram
 import json
 import os
+import re
+import time
+from threading import Lock
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson  # pinned in requirements; faster decoding of the calendar payload
+except ImportError:
+    orjson = None
+
+from utils import send_telegram, read_json_state, report_error, wait_for_shutdown
 
 # ---------------- Logging ----------------
-logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 logger = logging.getLogger("forex_news_alert")
+logger.addHandler(logging.NullHandler())
 
 # ---------------- Config ----------------
 WATCHED_CURRENCIES = ["EUR", "GBP", "USD", "JPY", "CHF", "AUD", "NZD", "CAD"]
-WATCHED_IMPACTS = ["High", "Medium"]
+WATCHED_CURRENCIES_SET = frozenset(WATCHED_CURRENCIES)  # O(1) country checks per event
+WATCHED_IMPACTS = frozenset({"High", "Medium"})
 NEWS_URL = "https://api.tradingeconomics.com/calendar?c=guest:guest"
 PRE_ALERT_MINUTES = 60
 IMPACT_EMOJI = {"High": "🔥", "Medium": "⚡"}
 
 # ---------------- Alert Tracking ----------------
-alerted_events = set()
+alerted_events = {}  # event_id -> wall-clock time it was alerted
 alert_lock = Lock()
 STATE_FILE = "bot_state.json"
+ALERTED_EVENTS_FILE = "alerted_events.jsonl"  # append-only, one [event_id, ts] per line
+ALERTED_EVENTS_RETENTION = 14 * 24 * 3600  # long after the event has left the calendar feed
+ALERTED_EVENTS_PRUNE_INTERVAL = 3600  # ids expire on a days scale; no need to scan every cycle
+_alerted_events_log = None  # append handle, opened on first write
 
-# ---------------- Load State ----------------
-if os.path.exists(STATE_FILE):
+def _log_ends_mid_line(path) -> bool:
+    """True if the file's last line lacks its newline (a write torn by a crash)."""
     try:
-        with open(STATE_FILE, "r") as f:
-            state = json.load(f)
-            alerted_events.update(state.get("alerted_events", []))
-        logger.info("✅ Restored alerted_events from state")
-    except Exception as e:
-        logger.error(f"Failed to restore state: {e}", exc_info=True)
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+    except FileNotFoundError:
+        return False
+
+def record_alerted_event(event_id, ts):
+    """Append a newly alerted event id to the JSONL log (call under alert_lock)."""
+    global _alerted_events_log
+    if _alerted_events_log is None:
+        torn = _log_ends_mid_line(ALERTED_EVENTS_FILE)
+        _alerted_events_log = open(ALERTED_EVENTS_FILE, "a", buffering=1)
+        if torn:
+            # Start on a fresh line so the new entry isn't glued onto the fragment
+            _alerted_events_log.write("\n")
+    _alerted_events_log.write(json.dumps([event_id, ts]) + "\n")
+
+def claim_alert(event_id) -> bool:
+    """Mark event_id as alerted; False if it already was."""
+    with alert_lock:
+        if event_id in alerted_events:
+            return False
+        ts = time.time()
+        alerted_events[event_id] = ts
+        record_alerted_event(event_id, ts)
+        return True
+
+def prune_alerted_events(max_age: float = ALERTED_EVENTS_RETENTION):
+    """Forget ids alerted more than max_age ago and compact the log down to the rest."""
+    global _alerted_events_log
+    cutoff = time.time() - max_age
+    with alert_lock:
+        stale = [event_id for event_id, ts in alerted_events.items() if ts < cutoff]
+        if not stale:
+            return
+        for event_id in stale:
+            del alerted_events[event_id]
+        _rewrite_alerted_events_log()
+    logger.info("🧹 Pruned %d stale alerted_events", len(stale))
+
+def _rewrite_alerted_events_log():
+    """Replace the log with one line per current id (call under alert_lock)."""
+    global _alerted_events_log
+    if _alerted_events_log is not None:
+        _alerted_events_log.close()
+        _alerted_events_log = None
+    tmp_path = ALERTED_EVENTS_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        for event_id, ts in alerted_events.items():
+            f.write(json.dumps([event_id, ts]) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, ALERTED_EVENTS_FILE)
+
+def close_alerted_events_log():
+    global _alerted_events_log
+    with alert_lock:
+        if _alerted_events_log is not None:
+            _alerted_events_log.close()
+            _alerted_events_log = None
+
+# ---------------- Load State ----------------
+try:
+    if os.path.exists(ALERTED_EVENTS_FILE):
+        loaded_at = time.time()
+        bad_lines = 0
+        with open(ALERTED_EVENTS_FILE, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                # One bad line (e.g. torn by a SIGKILL mid-write) must not drop the rest
+                try:
+                    entry = json.loads(line)
+                    if isinstance(entry, list):
+                        alerted_events[entry[0]] = float(entry[1])
+                    else:  # bare id from older versions; age it from now
+                        alerted_events[entry] = loaded_at
+                except (ValueError, TypeError, IndexError):
+                    bad_lines += 1
+        if bad_lines:
+            logger.warning("Skipped %d unreadable lines in %s; compacting it", bad_lines, ALERTED_EVENTS_FILE)
+            with alert_lock:
+                _rewrite_alerted_events_log()
+        logger.info("✅ Restored alerted_events from alerted_events.jsonl")
+
+    # Migrate ids saved by older versions inside bot_state.json
+    state = read_json_state(STATE_FILE) or {}
+    legacy_events = [e for e in state.get("alerted_events", []) if e not in alerted_events]
+    for event_id in legacy_events:
+        claim_alert(event_id)
+    if legacy_events:
+        logger.info(f"✅ Migrated {len(legacy_events)} alerted_events from bot_state.json")
+
+    prune_alerted_events()
+except Exception as e:
+    logger.error(f"Failed to restore state: {e}", exc_info=True)
 
 # ---------------- Fetch News ----------------
-async def fetch_tradingeconomics_events():
-    try:
-        response = requests.get(NEWS_URL, timeout=10)
-        response.raise_for_status()
-        events = response.json()
+NEWS_CACHE_TTL = 300  # reuse the parsed calendar for 5 minutes between refreshes
+_news_cache = {"etag": None, "last_modified": None, "events": [], "expires_at": 0.0}
+_news_cache_lock = Lock()
+# Keep-alive session: refreshes are serialized by _news_cache_lock, so one connection suffices.
+# Transient gateway errors are retried here; anything else falls back to the cached calendar
+_NEWS_SESSION = requests.Session()
+_NEWS_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1, pool_maxsize=1,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[502, 503, 504]),
+))
+
+def get_tradingeconomics_events():
+    """
+    Return the TradingEconomics calendar, cached for NEWS_CACHE_TTL seconds.
+    Refreshes send If-None-Match / If-Modified-Since, so an unchanged
+    calendar costs a 304 instead of a full download and JSON parse.
+    On failure the last good calendar is returned.
+    """
+    with _news_cache_lock:
+        now = time.monotonic()
+        if now < _news_cache["expires_at"]:
+            return _news_cache["events"]
+
+        headers = {}
+        if _news_cache["etag"]:
+            headers["If-None-Match"] = _news_cache["etag"]
+        if _news_cache["last_modified"]:
+            headers["If-Modified-Since"] = _news_cache["last_modified"]
+
+        try:
+            response = _NEWS_SESSION.get(NEWS_URL, headers=headers, timeout=10)
+            if response.status_code == 304:
+                _news_cache["expires_at"] = now + NEWS_CACHE_TTL
+                return _news_cache["events"]
+            response.raise_for_status()
+            events = orjson.loads(response.content) if orjson else response.json()
+        except Exception as e:
+            logger.error("[News] Failed to fetch events: %s", e)
+            return _news_cache["events"]
+
+        _news_cache.update(
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            events=events,
+            expires_at=now + NEWS_CACHE_TTL,
+        )
         return events
-    except Exception as e:
-        logger.error(f"[News] Failed to fetch events: {e}")
-        return []
+
+async def fetch_tradingeconomics_events():
+    # HTTP + JSON decode run in a worker thread so the event loop keeps serving other tasks
+    return await asyncio.to_thread(get_tradingeconomics_events)
 
 # ---------------- Filter Events ----------------
 def filter_relevant_events(events, currencies, watched_impacts):
+    if not currencies:
+        return []
+    # One regex scan per title instead of a substring test per currency (plain
+    # substrings, like `cur in title`); re caches the compiled pattern across calls
+    title_match = re.compile("|".join(map(re.escape, sorted(currencies)))).search
     filtered = []
     for event in events:
         impact = event.get("impact", "").capitalize()
@@ -54,7 +209,7 @@ def filter_relevant_events(events, currencies, watched_impacts):
 
         country = event.get("country", "")
         title = event.get("event", "")
-        if country not in currencies and not any(cur in title for cur in currencies):
+        if country not in currencies and not title_match(title):
             continue
 
         try:
@@ -62,8 +217,13 @@ def filter_relevant_events(events, currencies, watched_impacts):
         except Exception:
             continue
 
+        key = f"{event_time}_{country}_{title}"  # stable id, also the alerted_events prefix
         filtered.append({
             "time": event_time,
+            "ts": event_time.timestamp(),  # float for cheap per-cycle comparisons
+            "key": key,
+            "pre_id": f"{key}_pre",
+            "post_id": f"{key}_post",
             "currency": country,
             "impact": impact,
             "event": title,
@@ -73,18 +233,30 @@ def filter_relevant_events(events, currencies, watched_impacts):
         })
     return filtered
 
+# Watched events of the current calendar, re-filtered only when
+# get_tradingeconomics_events() hands back a new calendar
+_relevant_cache = (None, [])
+
+def relevant_watched_events(events):
+    """Return the watched events of a calendar, filtering it once per refresh."""
+    global _relevant_cache
+    cached_events, relevant = _relevant_cache
+    if cached_events is not events:
+        relevant = filter_relevant_events(events, WATCHED_CURRENCIES_SET, WATCHED_IMPACTS)
+        _relevant_cache = (events, relevant)
+    return relevant
+
 # ---------------- Pre/Post Alerts ----------------
-def trigger_pre_news_alert(event):
-    now = datetime.datetime.now(datetime.timezone.utc)
+def trigger_pre_news_alert(event, now=None, send_alert_fn=send_telegram):
+    # The news loop passes its per-cycle UTC snapshot; standalone calls read the clock
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
     delta = event['time'] - now
     minutes_until_event = int(delta.total_seconds() / 60)
 
     if PRE_ALERT_MINUTES - 1 <= minutes_until_event <= PRE_ALERT_MINUTES + 1:
-        event_id = f"{event['time']}_{event['currency']}_{event['event']}_pre"
-        with alert_lock:
-            if event_id in alerted_events:
-                return
-            alerted_events.add(event_id)
+        if not claim_alert(event["pre_id"]):
+            return
 
         emoji = IMPACT_EMOJI.get(event['impact'], "⚡")
         msg = (
@@ -92,76 +264,72 @@ def trigger_pre_news_alert(event):
             f"⏰ Time: {event['time'].strftime('%Y-%m-%d %H:%M UTC')} "
             f"(in {minutes_until_event} min)"
         )
-        send_telegram(msg)
-        logger.info(f"[News] Pre-news alert sent for {event['currency']} - {event['event']}")
+        send_alert_fn(msg)
+        logger.info("[News] Pre-news alert sent for %s - %s", event["currency"], event["event"])
 
-def trigger_post_news_alert(event):
+def trigger_post_news_alert(event, send_alert_fn=send_telegram):
     if not event.get("actual"):
         return
 
-    event_id = f"{event['time']}_{event['currency']}_{event['event']}_post"
-    with alert_lock:
-        if event_id in alerted_events:
-            return
-        alerted_events.add(event_id)
+    if not claim_alert(event["post_id"]):
+        return
 
     msg = (
         f"{event['currency']} {event['event']}: "
         f"Actual {event.get('actual')}, Forecast {event.get('forecast')}, Previous {event.get('previous')}"
     )
-    send_telegram(msg)
-    logger.info(f"[News] Post-news alert sent for {event['currency']} - {event['event']}")
+    send_alert_fn(msg)
+    logger.info("[News] Post-news alert sent for %s - %s", event["currency"], event["event"])
 
 # ---------------- Async News Loop (Updated Logging) ----------------
-async def run_news_alert_loop(shutdown_event: asyncio.Event = None):
+async def run_news_alert_loop(shutdown_event: asyncio.Event = None, send_alert_fn=send_telegram):
     """Continuously fetch news and send pre/post alerts, logging only new events."""
     logger.info("📡 Forex News Alert Loop Started!")
     seen_events = set()  # Track events already logged for cleaner output
+    next_prune = time.monotonic() + ALERTED_EVENTS_PRUNE_INTERVAL  # pruned once at import
 
     try:
         while shutdown_event is None or not shutdown_event.is_set():
             all_events = await fetch_tradingeconomics_events()
             now = datetime.datetime.now(datetime.timezone.utc)
-            relevant_events = filter_relevant_events(all_events, WATCHED_CURRENCIES, WATCHED_IMPACTS)
+            now_ts = now.timestamp()
+            relevant_events = relevant_watched_events(all_events)
 
+            current_keys = set()
+            next_event_ts = None
             for ev in relevant_events:
-                event_key = f"{ev['time']}_{ev['currency']}_{ev['event']}"
-                if event_key not in seen_events:
-                    logger.info(f"[News] New event detected: {ev['currency']} - {ev['event']} at {ev['time']}")
-                    seen_events.add(event_key)
-
-                delta = ev["time"] - now
-                minutes_until_event = delta.total_seconds() / 60
-
-                if 59 <= minutes_until_event <= 61:
-                    trigger_pre_news_alert(ev)
-                if now >= ev["time"]:
-                    trigger_post_news_alert(ev)
-
-            upcoming_events = [ev["time"] for ev in relevant_events if ev["time"] > now]
-            if upcoming_events:
-                next_event = min(upcoming_events)
-                sleep_seconds = max((next_event - datetime.timedelta(minutes=PRE_ALERT_MINUTES) - now).total_seconds(), 10)
+                current_keys.add(ev["key"])
+                if ev["key"] not in seen_events:
+                    logger.info("[News] New event detected: %s - %s at %s", ev["currency"], ev["event"], ev["time"])
+
+                seconds_until_event = ev["ts"] - now_ts
+                if seconds_until_event > 0:
+                    if next_event_ts is None or ev["ts"] < next_event_ts:
+                        next_event_ts = ev["ts"]
+                    # Pre-alert window is 59-61 minutes out; anything else is a float compare.
+                    # Already-alerted ids are skipped here without a thread hop (claim_alert re-checks)
+                    if 59 * 60 <= seconds_until_event <= 61 * 60 and ev["pre_id"] not in alerted_events:
+                        await asyncio.to_thread(trigger_pre_news_alert, ev, now, send_alert_fn)
+                elif ev["actual"] and ev["post_id"] not in alerted_events:  # needs the released figure
+                    await asyncio.to_thread(trigger_post_news_alert, ev, send_alert_fn)
+
+            # Only remember events still in the feed so the set can't grow forever
+            seen_events = current_keys
+            if time.monotonic() >= next_prune:
+                await asyncio.to_thread(prune_alerted_events)
+                next_prune = time.monotonic() + ALERTED_EVENTS_PRUNE_INTERVAL
+
+            if next_event_ts is not None:
+                sleep_seconds = max(next_event_ts - PRE_ALERT_MINUTES * 60 - now_ts, 10)
             else:
                 sleep_seconds = 300
-            await asyncio.sleep(sleep_seconds)
+            if await wait_for_shutdown(shutdown_event, sleep_seconds):
+                break
 
     except asyncio.CancelledError:
         logger.info("🛑 Forex News Alert loop cancelled")
     except Exception as e:
-        logger.error(f"[News] Error in news loop: {e}", exc_info=True)
+        report_error("news_loop", e)
     finally:
-        # Save alerted_events state on shutdown
-        try:
-            if alerted_events:
-                if os.path.exists(STATE_FILE):
-                    with open(STATE_FILE, "r") as f:
-                        state = json.load(f)
-                else:
-                    state = {}
-                state["alerted_events"] = list(alerted_events)
-                with open(STATE_FILE, "w") as f:
-                    json.dump(state, f, default=str)
-                logger.info("💾 Forex News Alert state saved on shutdown")
-        except Exception as e:
-            logger.error(f"Failed to save forex news state: {e}", exc_info=True)
+        # alerted_events are already on disk; just release the log handle
+        close_alerted_events_log()
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import app
+
+
+def test_slow_or_failing_job_does_not_hold_back_the_others(monkeypatch):
+    errors = []
+    fast_runs = []
+    monkeypatch.setattr(app, "report_error", lambda name, e: errors.append(name))
+    monkeypatch.setattr(app, "JOB_ERROR_RETRY", 0.01)
+    monkeypatch.setattr(app, "shutdown_event", asyncio.Event())
+
+    async def slow():
+        await asyncio.sleep(0.3)
+        return 60
+
+    async def failing():
+        raise RuntimeError("boom")
+
+    async def fast():
+        fast_runs.append(1)
+        return 0.01
+
+    async def main():
+        task = asyncio.create_task(app.scheduler({"slow": slow, "failing": failing, "fast": fast}))
+        await asyncio.sleep(0.2)
+        assert not task.done()
+        assert len(fast_runs) >= 5  # kept its own cadence while "slow" was still running
+        app.shutdown_event.set()
+        await asyncio.wait_for(task, timeout=1)
+
+    asyncio.run(main())
+
+    assert errors.count("failing") >= 5
+
+
+def test_prune_alert_times_drops_stale_pairs_but_keeps_kind_dicts(monkeypatch):
+    now = time.time()
+    strength = {"EUR_USD": now - app.ALERT_TIMES_RETENTION - 1}
+    groups = {"USD": now, "JPY": now - app.ALERT_TIMES_RETENTION - 1}
+    monkeypatch.setattr(app, "last_trade_alert_times", {"strength_alert": strength, "group_breakout": groups})
+
+    app.prune_alert_times()
+
+    assert app.last_trade_alert_times["strength_alert"] is strength
+    assert strength == {}
+    assert groups == {"USD": now}
@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+import breakout
+from config import CURRENCY_GROUPS
+from utils import calculate_ema
+
+
+@pytest.fixture(autouse=True)
+def isolated_breakout_state(monkeypatch):
+    # Fresh per-tick results and group cooldowns, on a tick that can't roll over mid-test
+    monkeypatch.setattr(breakout, "_breakout_results", {})
+    monkeypatch.setattr(breakout, "_last_group_alerts", {})
+    monkeypatch.setattr(breakout, "_d1_closed_ema", {})
+    monkeypatch.setattr(breakout, "_current_tick", lambda: 1)
+
+
+def test_group_alerts_from_one_scan_are_sent_as_one_message(monkeypatch):
+    monkeypatch.setattr(breakout, "is_forex_market_open", lambda: True)
+    usd_pairs = CURRENCY_GROUPS["USD"]
+    jpy_pairs = CURRENCY_GROUPS["JPY"]
+    breakout_results = {pair: True for pair in (*usd_pairs, *jpy_pairs)}
+    sent = []
+
+    alerts = breakout.run_group_breakout_alert(
+        send_alert_fn=sent.append, breakout_results=breakout_results, last_alert_times={}
+    )
+
+    assert {"USD", "JPY"} <= set(alerts)
+    assert len(sent) == 1
+    for group in alerts:
+        assert f"📢 {group} Group H4 Breakout Alert!" in sent[0]
+
+
+def test_group_alert_cooldown_suppresses_the_next_scan(monkeypatch):
+    monkeypatch.setattr(breakout, "is_forex_market_open", lambda: True)
+    breakout_results = {pair: True for pair in CURRENCY_GROUPS["USD"]}
+    last_alert_times = {}
+    sent = []
+
+    for _ in range(2):
+        breakout.run_group_breakout_alert(
+            send_alert_fn=sent.append, breakout_results=breakout_results,
+            last_alert_times=last_alert_times,
+        )
+
+    assert len(sent) == 1
+    assert "USD" in last_alert_times["group_breakout"]
+
+
+def test_malformed_pair_counts_as_no_breakout_without_failing_the_scan(monkeypatch):
+    fetched = {
+        "GOOD": [{"high": 1.2, "low": 0.9, "close": 1.0, "time": str(i)} for i in range(50)],
+        "BAD": [{"close": 1.0}, {"close": 1.1}],  # no high/low
+    }
+    monkeypatch.setattr(
+        breakout, "get_recent_candles_batch",
+        lambda pairs, timeframe, count: {pair: fetched[pair] for pair in pairs},
+    )
+
+    results = breakout.check_breakouts_h4(["GOOD", "BAD"])
+
+    assert results == {"GOOD": False, "BAD": False}
+    assert breakout.check_breakout_h4("BAD") is False  # recorded for the tick
+
+
+def _daily_candles(first_day, count=breakout.D1_WINDOW):
+    # OANDA "D" bars: one per day, the last one still forming
+    return [
+        {"time": f"day-{day}", "close": 1.1 + 0.01 * ((day * 7) % 11) - 0.0005 * day}
+        for day in range(first_day, first_day + count)
+    ]
+
+
+def _closes(candles):
+    return np.array([c["close"] for c in candles], dtype=np.float64)
+
+
+def test_d1_ema_memo_matches_a_full_recompute_on_daily_candles():
+    candles = _daily_candles(0)
+    assert breakout.d1_ema("EUR_USD", candles, _closes(candles)) == pytest.approx(
+        calculate_ema(_closes(candles), breakout.D1_EMA_PERIOD), rel=1e-12)
+
+    # The forming bar moves: only it is folded in, the closed-bar EMA is reused
+    cached = breakout._d1_closed_ema["EUR_USD"]
+    candles[-1]["close"] += 0.02
+    assert breakout.d1_ema("EUR_USD", candles, _closes(candles)) == pytest.approx(
+        calculate_ema(_closes(candles), breakout.D1_EMA_PERIOD), rel=1e-12)
+    assert breakout._d1_closed_ema["EUR_USD"] is cached
+
+    # A daily close shifts the window by one bar and rebuilds the memo
+    candles = _daily_candles(1)
+    assert breakout.d1_ema("EUR_USD", candles, _closes(candles)) == pytest.approx(
+        calculate_ema(_closes(candles), breakout.D1_EMA_PERIOD), rel=1e-12)
+    assert breakout._d1_closed_ema["EUR_USD"] is not cached
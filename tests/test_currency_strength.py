@@ -0,0 +1,27 @@
+import currency_strength
+
+
+def _ladder_loop(n, max_rank=7, min_rank=-7):
+    # Previous per-pass mapping from calculate_strength
+    ranks = []
+    for idx in range(n):
+        rank = int(round(max_rank - (idx * (max_rank - min_rank) / (n - 1))))
+        if rank == 0:
+            rank = 1 if idx < n / 2 else -1
+        ranks.append(rank)
+    return tuple(ranks)
+
+
+def test_rank_ladder_for_all_eight_currencies():
+    assert currency_strength.rank_ladder(8) == (7, 5, 3, 1, -1, -3, -5, -7)
+
+
+def test_rank_ladder_matches_the_previous_mapping_for_every_size():
+    for n in range(2, 9):
+        assert currency_strength.rank_ladder(n) == _ladder_loop(n)
+    assert currency_strength.rank_ladder(7) == (7, 5, 2, 1, -2, -5, -7)
+
+
+def test_rank_ladder_handles_one_or_no_scored_currency():
+    assert currency_strength.rank_ladder(1) == (7,)
+    assert currency_strength.rank_ladder(0) == ()
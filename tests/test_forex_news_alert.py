@@ -0,0 +1,71 @@
+import asyncio
+import importlib
+import json
+import time
+
+import forex_news_alert
+
+
+def _reload_in(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return importlib.reload(forex_news_alert)
+
+
+def test_torn_log_line_does_not_drop_later_entries(tmp_path, monkeypatch):
+    now = time.time()
+    (tmp_path / "alerted_events.jsonl").write_text(
+        json.dumps(["a_pre", now]) + "\n"
+        + '["b_pre", 17'  # torn by a crash mid-write
+        + "\n" + json.dumps(["c_post", now]) + "\n"
+    )
+
+    news = _reload_in(tmp_path, monkeypatch)
+    try:
+        assert set(news.alerted_events) == {"a_pre", "c_post"}
+        assert news.claim_alert("d_pre")
+        assert not news.claim_alert("c_post")
+    finally:
+        news.close_alerted_events_log()
+
+    news = _reload_in(tmp_path, monkeypatch)
+    news.close_alerted_events_log()
+    assert set(news.alerted_events) == {"a_pre", "c_post", "d_pre"}
+
+
+def test_append_after_torn_tail_starts_a_new_line(tmp_path, monkeypatch):
+    news = _reload_in(tmp_path, monkeypatch)
+    (tmp_path / "alerted_events.jsonl").write_text(json.dumps(["a_pre", time.time()]) + "\n" + '["b_pre", 1')
+    try:
+        assert news.claim_alert("c_pre")
+    finally:
+        news.close_alerted_events_log()
+
+    news = _reload_in(tmp_path, monkeypatch)
+    news.close_alerted_events_log()
+    assert set(news.alerted_events) == {"a_pre", "c_pre"}
+
+
+def _run_news_cycles(monkeypatch, cycles):
+    prunes = []
+    waits = []
+
+    async def no_events():
+        return []
+
+    async def wait(shutdown_event, timeout):
+        waits.append(timeout)
+        return len(waits) >= cycles
+
+    monkeypatch.setattr(forex_news_alert, "fetch_tradingeconomics_events", no_events)
+    monkeypatch.setattr(forex_news_alert, "wait_for_shutdown", wait)
+    monkeypatch.setattr(forex_news_alert, "prune_alerted_events", lambda: prunes.append(1))
+    monkeypatch.setattr(forex_news_alert, "close_alerted_events_log", lambda: None)
+    asyncio.run(forex_news_alert.run_news_alert_loop(asyncio.Event(), send_alert_fn=lambda msg: None))
+    return len(prunes)
+
+
+def test_news_loop_prunes_alerted_events_on_an_interval_not_every_cycle(monkeypatch):
+    assert _run_news_cycles(monkeypatch, 3) == 0  # pruned at import; next one is an hour out
+
+    monkeypatch.setattr(forex_news_alert, "ALERTED_EVENTS_PRUNE_INTERVAL", 0)
+    assert _run_news_cycles(monkeypatch, 3) == 3
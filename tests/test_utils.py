@@ -0,0 +1,301 @@
+import asyncio
+import datetime
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import pytz
+
+import utils
+
+
+def _counting_fetch(calls):
+    def fetch(pair, timeframe, count):
+        calls.append((pair, timeframe, count))
+        return [{"time": str(len(calls)), "open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0}]
+    return fetch
+
+
+def test_candle_cache_reuses_a_response_until_its_ttl_expires(monkeypatch):
+    calls = []
+    clock = [1000.0]
+    monkeypatch.setattr(utils, "_candle_cache", {})
+    monkeypatch.setattr(utils, "_fetch_recent_candles", _counting_fetch(calls))
+    monkeypatch.setattr(utils, "time", SimpleNamespace(monotonic=lambda: clock[0], time=time.time))
+
+    first = utils.get_recent_candles("EUR_USD", "H4", 30)
+    clock[0] += utils.CANDLE_CACHE_MAX_TTL - 1
+    assert utils.get_recent_candles("EUR_USD", "H4", 30) is first
+    assert len(calls) == 1
+
+    clock[0] += 2
+    assert utils.get_recent_candles("EUR_USD", "H4", 30) is not first
+    assert len(calls) == 2
+
+
+def test_candle_cache_keys_on_pair_timeframe_and_count(monkeypatch):
+    calls = []
+    monkeypatch.setattr(utils, "_candle_cache", {})
+    monkeypatch.setattr(utils, "_fetch_recent_candles", _counting_fetch(calls))
+
+    for args in [("EUR_USD", "H4", 30), ("EUR_USD", "H4", 50), ("EUR_USD", "H1", 30),
+                 ("GBP_USD", "H4", 30), ("EUR_USD", "H4", 30)]:
+        utils.get_recent_candles(*args)
+
+    assert len(calls) == 4
+
+
+def test_candle_cache_does_not_pin_an_empty_fetch(monkeypatch):
+    calls = []
+    monkeypatch.setattr(utils, "_candle_cache", {})
+    monkeypatch.setattr(utils, "_fetch_recent_candles", lambda *args: calls.append(args) or [])
+
+    utils.get_recent_candles("EUR_USD", "H4", 30)
+    utils.get_recent_candles("EUR_USD", "H4", 30)
+
+    assert len(calls) == 2
+
+
+def _utc(*args):
+    return pytz.utc.localize(datetime.datetime(*args))
+
+
+def test_market_is_closed_from_friday_to_sunday_17_00_new_york():
+    # 2024-01-05 is a Friday; New York is UTC-5 in January
+    assert utils.is_forex_market_open(_utc(2024, 1, 5, 21, 59))
+    assert not utils.is_forex_market_open(_utc(2024, 1, 5, 22, 0))
+    assert not utils.is_forex_market_open(_utc(2024, 1, 6, 12, 0))
+    assert not utils.is_forex_market_open(_utc(2024, 1, 7, 21, 59))
+    assert utils.is_forex_market_open(_utc(2024, 1, 7, 22, 0))
+    assert utils.is_forex_market_open(_utc(2024, 1, 10, 3, 0))
+
+
+def test_market_hours_follow_new_york_daylight_saving():
+    # 2024-07-05 is a Friday; New York is UTC-4 in July
+    assert utils.is_forex_market_open(_utc(2024, 7, 5, 20, 59))
+    assert not utils.is_forex_market_open(_utc(2024, 7, 5, 21, 0))
+    assert utils.is_forex_market_open(_utc(2024, 7, 7, 21, 0))
+
+
+def _candles(n=40):
+    closes = [1.1 + 0.01 * ((i * 7) % 11) - 0.002 * i for i in range(n)]
+    return [
+        {"high": c + 0.004 + 0.001 * (i % 3), "low": c - 0.003 - 0.001 * (i % 5), "close": c}
+        for i, c in enumerate(closes)
+    ]
+
+
+def _atr_all_ranges(candles, period=14):
+    # Previous implementation: every true range, then the last `period` averaged
+    if len(candles) < period:
+        return 0.0
+    trs = []
+    for i in range(1, len(candles)):
+        high = candles[i]["high"]
+        low = candles[i]["low"]
+        prev_close = candles[i - 1]["close"]
+        trs.append(max(high - low, abs(high - prev_close), abs(low - prev_close)))
+    return float(sum(trs[-period:]) / period)
+
+
+@pytest.mark.parametrize("n", [14, 15, 40])
+def test_atr_matches_the_full_true_range_version(n):
+    candles = _candles(n)
+    assert utils.atr(candles) == pytest.approx(_atr_all_ranges(candles))
+
+
+_CLOSES = [1.1 + 0.01 * ((i * 7) % 11) - 0.002 * i for i in range(250)]
+
+
+def _ema_loop(prices, period):
+    # Previous implementation: SMA seed, then the recurrence one price at a time
+    if len(prices) < period:
+        return None
+    ema = sum(prices[:period]) / period
+    multiplier = 2 / (period + 1)
+    for price in prices[period:]:
+        ema = (price - ema) * multiplier + ema
+    return ema
+
+
+@pytest.mark.parametrize("period,n", [(20, 20), (20, 21), (50, 120), (200, 250)])
+def test_calculate_ema_matches_the_loop(period, n):
+    closes = _CLOSES[:n]
+    assert utils.calculate_ema(closes, period) == pytest.approx(_ema_loop(closes, period), rel=1e-12)
+
+
+def test_calculate_ema_needs_a_full_period():
+    assert utils.calculate_ema(_CLOSES[:49], 50) is None
+
+
+def _bar(time, close):
+    return {"time": time, "open": close, "high": close, "low": close, "close": close}
+
+
+def test_daily_fetch_refetches_only_the_forming_bar(monkeypatch):
+    calls = []
+    bars = {250: [_bar(str(i), 1.0 + i) for i in range(250)], 1: [_bar("249", 9.9)]}
+
+    def fetch(pair, timeframe, count):
+        calls.append(count)
+        return bars[count]
+
+    monkeypatch.setattr(utils, "_daily_history", {})
+    monkeypatch.setattr(utils, "_fetch_recent_candles", fetch)
+
+    first = utils._fetch_daily_candles("EUR_USD", "D", 250)
+    second = utils._fetch_daily_candles("EUR_USD", "D", 250)
+
+    assert calls == [250, 1]
+    assert second[:-1] == first[:-1]
+    assert second[-1]["close"] == 9.9
+
+
+def test_daily_fetch_reloads_the_window_after_a_daily_close(monkeypatch):
+    calls = []
+    bars = {250: [_bar(str(i), 1.0) for i in range(250)], 1: [_bar("250", 2.0)]}
+
+    def fetch(pair, timeframe, count):
+        calls.append(count)
+        return bars[count]
+
+    monkeypatch.setattr(utils, "_daily_history", {})
+    monkeypatch.setattr(utils, "_fetch_recent_candles", fetch)
+
+    utils._fetch_daily_candles("EUR_USD", "D", 250)
+    utils._fetch_daily_candles("EUR_USD", "D", 250)
+
+    assert calls == [250, 1, 250]
+
+
+@pytest.mark.parametrize("period,n", [(10, 12), (10, 20), (14, 60)])
+def test_ema_slope_matches_pandas_ewm(period, n):
+    pd = pytest.importorskip("pandas")
+    closes = [1.1 + 0.01 * ((i * 7) % 11) - 0.002 * i for i in range(n)]
+    ema_series = pd.Series(closes).ewm(span=period, adjust=False).mean()
+    expected = ema_series.iloc[-1] - ema_series.iloc[-2]
+    assert utils.ema_slope(closes, period) == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+
+def test_ema_slope_is_zero_without_enough_closes():
+    assert utils.ema_slope([1.0] * 11, 10) == 0
+
+
+def test_market_hours_answer_is_reused_within_a_minute(monkeypatch):
+    checks = []
+    clock = [60 * 1000 + 5.0]
+    monkeypatch.setattr(utils, "_market_open_cache", (None, True))
+    monkeypatch.setattr(utils, "_is_forex_market_open_at", lambda now: checks.append(now) or False)
+    monkeypatch.setattr(utils, "time", SimpleNamespace(time=lambda: clock[0], monotonic=time.monotonic))
+
+    assert utils.is_forex_market_open() is False
+    clock[0] += 50
+    assert utils.is_forex_market_open() is False
+    assert len(checks) == 1
+
+    clock[0] += 10  # next minute
+    utils.is_forex_market_open()
+    assert len(checks) == 2
+
+
+def test_explicit_time_bypasses_the_market_hours_cache(monkeypatch):
+    monkeypatch.setattr(utils, "_market_open_cache", (int(time.time() // 60), False))
+    saturday = pytz.utc.localize(datetime.datetime(2024, 1, 6, 12))
+    wednesday = pytz.utc.localize(datetime.datetime(2024, 1, 10, 12))
+
+    assert utils.is_forex_market_open(wednesday) is True
+    assert utils.is_forex_market_open(saturday) is False
+
+
+def _rsi_three_pass(closes, period=14):
+    # Previous implementation: deltas, then gains and losses in separate passes
+    if len(closes) < period + 1:
+        return []
+    deltas = [closes[i + 1] - closes[i] for i in range(len(closes) - 1)]
+    gains = [max(delta, 0) for delta in deltas]
+    losses = [abs(min(delta, 0)) for delta in deltas]
+    avg_gain = sum(gains[:period]) / period
+    avg_loss = sum(losses[:period]) / period
+    rsis = [100 if avg_loss == 0 else 100 - (100 / (1 + (avg_gain / avg_loss)))]
+    for i in range(period, len(gains)):
+        avg_gain = (avg_gain * (period - 1) + gains[i]) / period
+        avg_loss = (avg_loss * (period - 1) + losses[i]) / period
+        rs = avg_gain / avg_loss if avg_loss != 0 else float("inf")
+        rsis.append(100 - (100 / (1 + rs)))
+    return rsis
+
+
+@pytest.mark.parametrize("closes", [
+    [1.1 + 0.01 * ((i * 7) % 11) - 0.002 * i for i in range(60)],
+    [1.0 + 0.001 * i for i in range(20)],  # only gains
+    [1.0, 1.0, 1.0] * 6,  # flat stretches
+])
+def test_rsi_matches_the_three_pass_version(closes):
+    assert utils.rsi(closes) == pytest.approx(_rsi_three_pass(closes))
+
+
+def test_seconds_until_market_open_counts_down_to_sunday_17_00_new_york():
+    saturday_noon = pytz.utc.localize(datetime.datetime(2024, 1, 6, 12))
+    # Reopen is Sunday 2024-01-07 17:00 EST = 22:00 UTC
+    assert utils.seconds_until_market_open(saturday_noon) == 34 * 3600
+
+
+def test_seconds_until_market_open_covers_the_friday_close_and_dst():
+    friday_after_close = pytz.utc.localize(datetime.datetime(2024, 7, 5, 21, 30))
+    # Reopen is Sunday 2024-07-07 17:00 EDT = 21:00 UTC
+    assert utils.seconds_until_market_open(friday_after_close) == 47.5 * 3600
+
+
+def test_seconds_until_market_open_is_zero_while_open():
+    wednesday = pytz.utc.localize(datetime.datetime(2024, 1, 10, 12))
+    assert utils.seconds_until_market_open(wednesday) == 0.0
+
+
+def test_send_threadsafe_sends_directly_when_the_batcher_is_not_running(monkeypatch):
+    sent = []
+    monkeypatch.setattr(utils, "send_telegram", lambda message: sent.append(message) or True)
+
+    assert utils.TelegramBatcher().send_threadsafe("hello") is True
+    assert sent == ["hello"]
+
+
+def test_send_threadsafe_falls_back_to_a_direct_send_on_timeout(monkeypatch):
+    direct = []
+    monkeypatch.setattr(utils, "send_telegram", lambda message: direct.append(message) or True)
+    batcher = utils.TelegramBatcher(flush_interval=60, send_timeout=0.05)
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever)
+    thread.start()
+
+    async def start():
+        batcher.start()
+
+    try:
+        asyncio.run_coroutine_threadsafe(start(), loop).result(timeout=1)
+        assert batcher.send_threadsafe("slow batch") is True
+        assert direct == ["slow batch"]
+    finally:
+        asyncio.run_coroutine_threadsafe(batcher.stop(), loop).result(timeout=1)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+
+def test_stop_resolves_futures_of_a_batch_cut_off_mid_send(monkeypatch):
+    async def hanging_send(message):
+        await asyncio.sleep(60)
+        return True
+
+    monkeypatch.setattr(utils, "send_telegram_async", hanging_send)
+
+    async def main():
+        batcher = utils.TelegramBatcher(flush_interval=0)
+        batcher.start()
+        fut = batcher.enqueue("heartbeat", key="heartbeat")
+        await asyncio.sleep(0.05)  # the batch is now waiting on the send
+        await asyncio.wait_for(batcher.stop(), timeout=1)
+        assert fut.done() and fut.result() is False
+        assert batcher._pending == {}
+
+    asyncio.run(main())
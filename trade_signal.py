@@ -3,21 +3,22 @@ import logging
 import time
 from typing import Dict, List, Optional
 from currency_strength import run_currency_strength_alert, strength_filter
-from config import PAIRS, LOOP_INTERVAL, ALERT_COOLDOWN
+from config import PAIR_CURRENCIES, LOOP_INTERVAL, ALERT_COOLDOWN
 from utils import (
     get_recent_candles, atr, send_alert, load_active_trades, save_active_trades,
-    rsi, calculate_ema
+    rsi, calculate_ema, report_error, wait_for_shutdown, is_forex_market_open,
+    seconds_until_market_open
 )
 from breakout import check_breakout_h4
 
 # ---------------- Logger ----------------
 logger = logging.getLogger("trade_signal")
+logger.addHandler(logging.NullHandler())
 logger.setLevel(logging.INFO)
-logging.basicConfig(level=logging.INFO)
 
 # ---------------- State ----------------
 _ACTIVE_TRADES: List[Dict] = load_active_trades()
-_LAST_ALERT_TIME: Dict[str, float] = {}
+_LAST_ALERT_TIME: Dict[str, float] = {}  # pair -> time.monotonic() of last alert
 MIN_RRR = 2.0
 
 # ================= SAFE D1 FETCH =================
@@ -28,39 +29,40 @@ def get_safe_d1_candles(pair: str, max_count: int = 50) -> list[dict]:
     """
     counts_to_try = [max_count, max_count // 2, 10]
     for count in counts_to_try:
-        candles = get_recent_candles(pair, "D1", count)
+        candles = get_recent_candles(pair, "D", count)
         if candles:
             return candles
         else:
-            logger.warning(f"{pair} D1 candles not available with count {count} (market may be closed)")
-    logger.warning(f"No D1 candles available for {pair}. Skipping pair.")
+            logger.warning("%s D1 candles not available with count %d (market may be closed)", pair, count)
+    logger.warning("No D1 candles available for %s. Skipping pair.", pair)
     return []
 
 # ---------------- Build Trade Signal ----------------
-def build_trade_signal(pair: str, base_val: int, quote_val: int, rank_map: dict, debug: bool = False) -> Optional[Dict]:
+def build_trade_signal(pair: str, base_val: int, quote_val: int, rank_map: dict, debug: bool = False,
+                       send_alert_fn=send_alert) -> Optional[Dict]:
     now = time.time()
+    now_mono = time.monotonic()
 
     # ---------------- Cooldown Check ----------------
-    if now - _LAST_ALERT_TIME.get(pair, 0) < ALERT_COOLDOWN:
+    if now_mono - _LAST_ALERT_TIME.get(pair, float("-inf")) < ALERT_COOLDOWN:
         if debug:
-            logger.info(f"Skipped {pair}: Alert cooldown active")
+            logger.info("Skipped %s: Alert cooldown active", pair)
         return None
 
     # ---------------- H4 Candles & Indicators ----------------
     candles_4h = get_recent_candles(pair, "H4", 250)
     if not candles_4h or len(candles_4h) < 3:
         if debug:
-            logger.info(f"Skipped {pair}: Missing H4 candles")
+            logger.info("Skipped %s: Missing H4 candles", pair)
         return None
 
-    closes = [float(c["close"]) for c in candles_4h]
-    highs = [float(c["high"]) for c in candles_4h]
-    lows = [float(c["low"]) for c in candles_4h]
+    # One pass over the candles; highs/lows are never read here (atr() takes the candles)
+    closes = [c["close"] for c in candles_4h]
 
     h4_rsi_values = rsi(closes)
     if not h4_rsi_values:
         if debug:
-            logger.info(f"Skipped {pair}: Cannot calculate H4 RSI")
+            logger.info("Skipped %s: Cannot calculate H4 RSI", pair)
         return None
     h4_rsi = h4_rsi_values[-1]
 
@@ -75,14 +77,17 @@ def build_trade_signal(pair: str, base_val: int, quote_val: int, rank_map: dict,
     candles_d1 = get_safe_d1_candles(pair, max_count=50)
     if not candles_d1 or len(candles_d1) < 2:
         if debug:
-            logger.info(f"Skipped {pair}: Not enough D1 candles (market closed or unavailable)")
+            logger.info("Skipped %s: Not enough D1 candles (market closed or unavailable)", pair)
         ema_200_d1 = None
         d1_trend_up = d1_trend_down = True
     else:
         closes_d1 = [float(c["close"]) for c in candles_d1]
         ema_200_d1 = calculate_ema(closes_d1, period=200)
-        d1_trend_up = closes_d1[-1] > ema_200_d1
-        d1_trend_down = closes_d1[-1] < ema_200_d1
+        if ema_200_d1 is None:  # fewer closes than the EMA period: treat the trend as neutral
+            d1_trend_up = d1_trend_down = True
+        else:
+            d1_trend_up = closes_d1[-1] > ema_200_d1
+            d1_trend_down = closes_d1[-1] < ema_200_d1
 
     # ---------------- Direction and Strength ----------------
     direction = "BUY" if base_val > quote_val else "SELL"
@@ -111,11 +116,11 @@ def build_trade_signal(pair: str, base_val: int, quote_val: int, rank_map: dict,
     }
 
     if debug:
-        logger.info(f"Checking {pair}: {conditions} | Candle: {candle_ok} | Breakout: {h4_breakout}")
+        logger.info("Checking %s: %s | Candle: %s | Breakout: %s", pair, conditions, candle_ok, h4_breakout)
 
     if not all(conditions.values()):
         if debug:
-            logger.info(f"Skipped {pair}: Conditions not met")
+            logger.info("Skipped %s: Conditions not met", pair)
         return None
 
     # ---------------- Entry / SL / TP ----------------
@@ -140,8 +145,8 @@ def build_trade_signal(pair: str, base_val: int, quote_val: int, rank_map: dict,
         f"Entry: {entry:.5f} | SL: {stop_loss:.5f} | ATR: {atr_val:.5f}\n"
         f"TPs: TP1:{tp1:.5f}, TP2:{tp2:.5f}, TP3:{tp3:.5f} | Min RRR:1:{MIN_RRR}"
     )
-    send_alert(alert_msg)
-    _LAST_ALERT_TIME[pair] = now
+    send_alert_fn(alert_msg)
+    _LAST_ALERT_TIME[pair] = now_mono
 
     # Store trade info
     trade_info = {
@@ -165,45 +170,70 @@ def build_trade_signal(pair: str, base_val: int, quote_val: int, rank_map: dict,
     return trade_info
 
 # ---------------- Async Trade Loop ----------------
-async def run_trade_signal_loop_async(debug: bool = False):
+async def run_trade_signal_loop_async(debug: bool = False, shutdown_event: asyncio.Event = None,
+                                      last_trade_alert_times: Optional[Dict] = None,
+                                      send_alert_fn=send_alert):
+    """
+    Scan ranked pairs for trade signals every LOOP_INTERVAL.
+    Pass the application's `last_trade_alert_times` so strength-alert cooldowns
+    are shared (and persisted) instead of tracked in a private copy, and its
+    batcher's `send_alert_fn` so trade and strength alerts are batched.
+    """
     logger.info("📡 Async Trade Signal Loop Started")
-    last_trade_alert_times: Dict = {}
+    if last_trade_alert_times is None:
+        last_trade_alert_times = {}
 
-    while True:
+    while shutdown_event is None or not shutdown_event.is_set():
         try:
-            rank_map, _ = run_currency_strength_alert(last_trade_alert_times=last_trade_alert_times)
+            if not is_forex_market_open():
+                # Weekend close: candles are frozen, so sleep straight through to the reopen
+                await wait_for_shutdown(shutdown_event, max(LOOP_INTERVAL, seconds_until_market_open()))
+                continue
+
+            # Strength ranking and signal builds do blocking OANDA I/O; keep them off the event loop
+            rank_map, _ = await asyncio.to_thread(
+                run_currency_strength_alert, last_trade_alert_times=last_trade_alert_times,
+                send_alert_fn=send_alert_fn
+            )
             if not rank_map:
-                await asyncio.sleep(LOOP_INTERVAL)
+                await wait_for_shutdown(shutdown_event, LOOP_INTERVAL)
                 continue
 
             candidate_pairs = []
-            for pair in PAIRS:
-                if "_" not in pair:
-                    continue
-                base, quote = pair.split("_")
+            for pair, (base, quote) in PAIR_CURRENCIES.items():
                 base_val, quote_val = rank_map.get(base), rank_map.get(quote)
                 if base_val is None or quote_val is None:
                     if debug:
-                        logger.info(f"Skipped {pair}: Missing strength values")
+                        logger.info("Skipped %s: Missing strength values", pair)
+                    continue
+                # build_trade_signal rejects anything failing strength_filter; skip it before any fetch
+                if not strength_filter(max(base_val, quote_val), min(base_val, quote_val)):
                     continue
                 candidate_pairs.append((abs(base_val - quote_val), pair, base_val, quote_val))
 
             # Trigger only top candidate per loop
+            trade_info = None
             for _, pair, base_val, quote_val in sorted(candidate_pairs, reverse=True, key=lambda x: x[0]):
-                trade_info = build_trade_signal(pair, base_val, quote_val, rank_map, debug=debug)
+                trade_info = await asyncio.to_thread(
+                    build_trade_signal, pair, base_val, quote_val, rank_map, debug=debug,
+                    send_alert_fn=send_alert_fn
+                )
                 if trade_info:
                     break
                 else:
                     if debug:
-                        logger.info(f"❌ Skipped {pair}")
+                        logger.info("❌ Skipped %s", pair)
 
-            save_active_trades(_ACTIVE_TRADES)
-            await asyncio.sleep(LOOP_INTERVAL)
+            # Only hit the disk when a trade was actually added
+            if trade_info:
+                await asyncio.to_thread(save_active_trades, _ACTIVE_TRADES)
+            await wait_for_shutdown(shutdown_event, LOOP_INTERVAL)
 
         except Exception as e:
-            logger.error(f"Unexpected error in trade loop: {e}", exc_info=True)
-            await asyncio.sleep(5)
+            report_error("trade_signal_loop", e)
+            await wait_for_shutdown(shutdown_event, 5)
 
 # ---------------- Entry Point ----------------
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
     asyncio.run(run_trade_signal_loop_async(debug=True))
@@ -1,44 +1,247 @@
 import requests
 import logging
+import asyncio
 import pytz
-from datetime import datetime
-import pandas as pd
+from datetime import datetime, timedelta
+import numpy as np
 import json
 import os
 import time
+from threading import Lock, BoundedSemaphore
+from concurrent.futures import ThreadPoolExecutor, CancelledError as FutureCancelledError, TimeoutError as FutureTimeoutError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from requests.exceptions import RequestException
 
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+try:
+    import orjson  # pinned in requirements; faster decoding of large candle responses
+except ImportError:
+    orjson = None
+
 from config import TELEGRAM_TOKEN, TELEGRAM_CHAT_ID, OANDA_API, HEADERS
 
 logger = logging.getLogger("utils")
-logging.basicConfig(level=logging.INFO)
+logger.addHandler(logging.NullHandler())  # handlers belong to the app (see app.py)
 
-# Track closed D1 markets to avoid repeated 400 errors
+# Track closed daily ("D") markets to avoid repeated 400 errors
 _D1_MARKET_CLOSED: dict[str, bool] = {}
 
 # ================= TELEGRAM =================
+# One pooled keep-alive session so repeated alerts reuse the TLS connection
+_TELEGRAM_SESSION = requests.Session()
+_TELEGRAM_SESSION.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
 def send_telegram(message: str) -> bool:
     """Send a message via Telegram bot."""
     try:
         url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-        resp = requests.post(url, data={"chat_id": TELEGRAM_CHAT_ID, "text": message})
+        resp = _TELEGRAM_SESSION.post(url, data={"chat_id": TELEGRAM_CHAT_ID, "text": message}, timeout=10)
         resp.raise_for_status()
         return True
     except Exception as e:
         logger.error(f"Failed to send telegram message: {e}")
         return False
 
+async def send_telegram_async(message: str) -> bool:
+    """Send a Telegram message without blocking the event loop."""
+    return await asyncio.to_thread(send_telegram, message)
+
 # Alias for backward compatibility
 send_alert = send_telegram
 
+# ================= ERROR ALERTS =================
+ERROR_ALERT_COOLDOWN = 300  # at most one failure alert per component every 5 minutes
+_last_error_alert: dict[str, float] = {}
+
+def report_error(component: str, exc: Exception) -> None:
+    """
+    Log a failure and alert Telegram about it, rate-limited per component
+    so a persistent outage doesn't flood the channel every cycle.
+    Safe to call from coroutines: the send then runs in a worker thread.
+    """
+    now = time.monotonic()
+    if now - _last_error_alert.get(component, float("-inf")) < ERROR_ALERT_COOLDOWN:
+        logger.error("[%s] %s (alert suppressed, cooldown active)", component, exc)
+        return
+    _last_error_alert[component] = now
+    logger.error("[%s] %s", component, exc, exc_info=exc)
+    message = f"⚠️ {component}: {exc}"
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        send_telegram(message)  # worker thread or plain sync caller
+        return
+    # Fire and forget: a slow Telegram (10s timeout) must not stall the event loop
+    loop.run_in_executor(None, send_telegram, message)
+
+# ================= SHUTDOWN-AWARE SLEEP =================
+async def wait_for_shutdown(shutdown_event, timeout: float) -> bool:
+    """
+    Sleep up to `timeout` seconds, waking immediately if `shutdown_event` is set.
+    Returns True when shutdown was requested. A None event is a plain sleep.
+    """
+    if shutdown_event is None:
+        await asyncio.sleep(timeout)
+        return False
+    try:
+        await asyncio.wait_for(shutdown_event.wait(), timeout=timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+# ================= TELEGRAM BATCHING =================
+TELEGRAM_MAX_CHARS = 4000  # Telegram rejects messages over 4096 chars
+
+class TelegramBatcher:
+    """
+    Queue Telegram messages and flush them in as few sendMessage calls as possible.
+    Messages queued within `flush_interval` are joined with a blank line until
+    the next one would push the payload over `max_chars`.
+    """
+
+    def __init__(self, flush_interval: float = 3.0, max_chars: int = TELEGRAM_MAX_CHARS,
+                 send_timeout: float = 30.0):
+        self.flush_interval = flush_interval
+        self.max_chars = max_chars
+        self.send_timeout = send_timeout  # longest a worker thread waits on a batched send
+        self._loop = None
+        self._queue = None
+        self._task = None
+        self._head = None
+        self._pending = {}  # dedupe key -> future, kept only while queued
+
+    def start(self):
+        """Start the background flush task on the running event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the flush task and send whatever is still queued.
+        Every future handed out by enqueue() is resolved by the time this returns.
+        """
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self._flush()
+
+    def enqueue(self, message: str, key=None) -> asyncio.Future:
+        """
+        Queue a message; the returned future resolves to True once it was sent.
+        Messages sharing the same `key` collapse into one while still queued.
+        """
+        if key is not None and key in self._pending:
+            return self._pending[key]
+        fut = self._loop.create_future()
+        if key is not None:
+            self._pending[key] = fut
+        self._queue.put_nowait((message, key, fut))
+        return fut
+
+    def send_threadsafe(self, message: str, key=None) -> bool:
+        """
+        Blocking drop-in for send_telegram() from worker threads.
+        Sends directly when the batcher is not running or when called from
+        the loop thread itself, where waiting on the batch would deadlock,
+        and when the batch doesn't go out within `send_timeout`.
+        """
+        if (self._task is None or self._loop is None or not self._loop.is_running()
+                or self._on_loop_thread()):
+            return send_telegram(message)
+
+        async def _enqueue_and_wait():
+            if self._task is None:  # stopped while this was scheduled; nothing would flush it
+                return await send_telegram_async(message)
+            return await self.enqueue(message, key)
+
+        future = asyncio.run_coroutine_threadsafe(_enqueue_and_wait(), self._loop)
+        try:
+            return future.result(timeout=self.send_timeout)
+        except FutureCancelledError:  # loop shut down before the batch went out
+            return send_telegram(message)
+        except FutureTimeoutError:
+            future.cancel()
+            logger.warning("Batched Telegram send timed out after %.0fs; sending directly", self.send_timeout)
+            return send_telegram(message)
+
+    def _on_loop_thread(self) -> bool:
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    async def _run(self):
+        while True:
+            # Wait for the first message, then give others a window to join it
+            self._head = await self._queue.get()
+            await asyncio.sleep(self.flush_interval)
+            await self._flush()
+
+    async def _flush(self):
+        items = [self._head] if self._head else []
+        self._head = None
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+
+        try:
+            batch, batch_len = [], 0
+            for item in items:
+                msg_len = len(item[0])
+                if batch and batch_len + 2 + msg_len > self.max_chars:
+                    await self._send_batch(batch)
+                    batch, batch_len = [], 0
+                batch_len += msg_len + (2 if batch else 0)
+                batch.append(item)
+            if batch:
+                await self._send_batch(batch)
+        finally:
+            # Cancelled or failed mid-flush: whatever wasn't sent counts as not sent,
+            # so no caller is left waiting and no dedupe key stays pinned
+            for _, key, fut in items:
+                if key is not None and self._pending.get(key) is fut:
+                    del self._pending[key]
+                if not fut.done():
+                    fut.set_result(False)
+
+    async def _send_batch(self, batch):
+        for _, key, _ in batch:
+            if key is not None:
+                self._pending.pop(key, None)
+        text = "\n\n".join(message for message, _, _ in batch)
+        ok = await send_telegram_async(text)
+        for _, _, fut in batch:
+            if not fut.done():
+                fut.set_result(ok)
+
 # ================= OANDA CANDLES =================
+# Shared keep-alive session: every candle fetch reuses pooled TLS connections
+OANDA_SESSION = requests.Session()
+OANDA_SESSION.headers.update(HEADERS)
+# Connect-level retries only: HTTP status errors are retried with backoff in fetch_oanda_candles
+OANDA_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=4, pool_maxsize=16,
+    max_retries=Retry(total=2, connect=2, read=0, status=0, backoff_factor=0.3),
+))
+
+# Process-wide cap on in-flight OANDA requests, whichever pool or thread issues them
+OANDA_MAX_CONCURRENT_REQUESTS = 8
+_OANDA_REQUEST_SLOTS = BoundedSemaphore(OANDA_MAX_CONCURRENT_REQUESTS)
+
 def fetch_oanda_candles(pair: str, granularity: str = "H4", count: int = 30, max_retries: int = 3, backoff: float = 1.5) -> list:
     """
     Fetch OANDA candles with automatic retry.
     Automatically skips D1 if market closed to avoid repeated 400 errors.
     """
     # Skip D1 if previously marked as closed
-    if granularity == "D1" and _D1_MARKET_CLOSED.get(pair, False):
+    if granularity == "D" and _D1_MARKET_CLOSED.get(pair, False):
         return []
 
     url = f"{OANDA_API}/instruments/{pair}/candles"
@@ -46,40 +249,120 @@ def fetch_oanda_candles(pair: str, granularity: str = "H4", count: int = 30, max
 
     for attempt in range(1, max_retries + 1):
         try:
-            r = requests.get(url, headers=HEADERS, params=params, timeout=10)
+            with _OANDA_REQUEST_SLOTS:
+                r = OANDA_SESSION.get(url, params=params, timeout=10)
             r.raise_for_status()
-            candles = r.json().get("candles", [])
+            payload = orjson.loads(r.content) if orjson else r.json()
+            candles = payload.get("candles", [])
 
             # Mark D1 as closed if empty response
-            if granularity == "D1" and not candles:
+            if granularity == "D" and not candles:
                 _D1_MARKET_CLOSED[pair] = True
-                logger.warning(f"{pair} D1 market appears closed. Skipping D1 fetch.")
+                logger.warning("%s D1 market appears closed. Skipping D1 fetch.", pair)
 
             return candles
 
         except requests.HTTPError as e:
-            if granularity == "D1" and e.response.status_code == 400:
+            status = e.response.status_code
+            if granularity == "D" and status == 400:
                 _D1_MARKET_CLOSED[pair] = True
-                logger.warning(f"{pair} D1 market appears closed (HTTP 400). Skipping D1 fetch.")
+                logger.warning("%s D1 market appears closed (HTTP 400). Skipping D1 fetch.", pair)
+                return []
+            if status != 429 and status < 500:
+                # Other client errors won't succeed on retry
+                logger.error("Failed to fetch %s candles (%s): %s", pair, granularity, e)
                 return []
             wait_time = backoff ** attempt
-            logger.warning(f"[Attempt {attempt}/{max_retries}] Failed to fetch {pair} candles ({granularity}): {e}. Retrying in {wait_time:.1f}s...")
+            if status == 429:
+                # Rate limited: honor the server's Retry-After when it sends one
+                try:
+                    wait_time = max(wait_time, float(e.response.headers.get("Retry-After", 0)))
+                except ValueError:
+                    pass
+            logger.warning("[Attempt %d/%d] Failed to fetch %s candles (%s): %s. Retrying in %.1fs...", attempt, max_retries, pair, granularity, e, wait_time)
             time.sleep(wait_time)
 
         except Exception as e:
-            logger.error(f"Unexpected error fetching {pair} candles ({granularity}): {e}")
+            logger.error("Unexpected error fetching %s candles (%s): %s", pair, granularity, e)
             break
 
-    logger.error(f"Failed to fetch OANDA candles for {pair} at {granularity} after {max_retries} attempts.")
+    logger.error("Failed to fetch OANDA candles for %s at %s after %d attempts.", pair, granularity, max_retries)
     return []
 
+# ================= CANDLE CACHE =================
+# Bar length per granularity; only these close on fixed UTC boundaries
+# (H4/D align to OANDA's 17:00 New York daily alignment instead).
+GRANULARITY_SECONDS = {"M1": 60, "M5": 300, "M15": 900, "M30": 1800, "H1": 3600}
+# The newest OANDA candle is still forming, so never reuse a response for
+# longer than this even when the bar itself closes much later.
+CANDLE_CACHE_MAX_TTL = 30
+
+_candle_cache: dict[tuple, tuple[float, list[dict]]] = {}  # (pair, tf, count) -> (expires_at, candles)
+_candle_cache_lock = Lock()
+
+def _candle_cache_ttl(timeframe: str) -> float:
+    """Seconds until the current bar closes, capped at CANDLE_CACHE_MAX_TTL."""
+    period = GRANULARITY_SECONDS.get(timeframe)
+    if period is None:
+        return CANDLE_CACHE_MAX_TTL
+    return min(period - time.time() % period, CANDLE_CACHE_MAX_TTL)
+
 def get_recent_candles(pair: str, timeframe: str = "H4", count: int = 30) -> list[dict]:
-    """Return normalized candle data for the given pair and timeframe."""
+    """
+    Return normalized candle data for the given pair and timeframe.
+    Responses are shared for a short TTL so the breakout, strength and
+    trade loops don't refetch the same candles within one cycle.
+    """
+    key = (pair, timeframe, count)
+    now = time.monotonic()
+    with _candle_cache_lock:
+        entry = _candle_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+
+    if timeframe == "D" and count > 1:
+        candles = _fetch_daily_candles(pair, timeframe, count)
+    else:
+        candles = _fetch_recent_candles(pair, timeframe, count)
+    if candles:  # don't pin an empty/failed fetch
+        with _candle_cache_lock:
+            _candle_cache[key] = (now + _candle_cache_ttl(timeframe), candles)
+    return candles
+
+# Closed daily bars only change at the daily close; between closes just the
+# forming bar is refetched and appended to the remembered history.
+_daily_history: dict[tuple, tuple[str, list[dict]]] = {}  # (pair, tf, count) -> (forming bar time, closed bars)
+
+def _fetch_daily_candles(pair: str, timeframe: str, count: int) -> list[dict]:
+    key = (pair, timeframe, count)
+    history = _daily_history.get(key)
+    if history:
+        latest = _fetch_recent_candles(pair, timeframe, 1)
+        if latest and latest[-1]["time"] == history[0]:
+            return history[1] + latest
+    candles = _fetch_recent_candles(pair, timeframe, count)
+    if candles:
+        _daily_history[key] = (candles[-1]["time"], candles[:-1])
+    return candles
+
+def _fetch_recent_candles(pair: str, timeframe: str, count: int) -> list[dict]:
     raw_candles = fetch_oanda_candles(pair, timeframe, count)
     normalized = []
     for c in raw_candles:
         if isinstance(c, dict):
             mid = c.get("mid", c)
+            try:
+                # OANDA's shape: mid always carries o/h/l/c, so index directly
+                normalized.append({
+                    "time": c.get("time"),
+                    "open": float(mid["o"]),
+                    "high": float(mid["h"]),
+                    "low": float(mid["l"]),
+                    "close": float(mid["c"]),
+                })
+                continue
+            except KeyError:
+                pass
             normalized.append({
                 "time": c.get("time"),
                 "open": float(mid.get("o", mid.get("open", 0))),
@@ -89,6 +372,32 @@ def get_recent_candles(pair: str, timeframe: str = "H4", count: int = 30) -> lis
             })
     return normalized
 
+# One shared pool for fanned-out candle fetches (breakout scan, strength ranking),
+# sized to the OANDA session's connection pool share
+CANDLE_FETCH_WORKERS = 8
+_CANDLE_EXECUTOR = ThreadPoolExecutor(max_workers=CANDLE_FETCH_WORKERS, thread_name_prefix="candles")
+
+def shutdown_candle_executor():
+    """Drop queued fetches and release the pool's threads on shutdown."""
+    _CANDLE_EXECUTOR.shutdown(wait=False, cancel_futures=True)
+
+def get_recent_candles_batch(pairs, timeframe: str = "H4", count: int = 30, executor=None) -> dict[str, list[dict]]:
+    """
+    Fetch the same candle window for many pairs, returning {pair: candles}.
+    OANDA only serves candles per instrument, so the requests fan out over
+    the pooled session in parallel; results land in the candle cache.
+    """
+    executor = executor or _CANDLE_EXECUTOR
+    futures = {pair: executor.submit(get_recent_candles, pair, timeframe, count) for pair in pairs}
+    results = {}
+    for pair, future in futures.items():
+        try:
+            results[pair] = future.result()
+        except Exception as e:
+            logger.error("Batch candle fetch failed for %s (%s): %s", pair, timeframe, e)
+            results[pair] = []
+    return results
+
 # Alias
 get_candles = get_recent_candles
 
@@ -108,21 +417,29 @@ def ema(values: list, period: int = 14) -> list:
 def atr(candles: list, period: int = 14) -> float:
     if len(candles) < period:
         return 0.0
+    # Only the last `period` true ranges are averaged, so skip building the rest
     trs = []
-    for i in range(1, len(candles)):
+    for i in range(max(1, len(candles) - period), len(candles)):
         high = candles[i]["high"]
         low = candles[i]["low"]
         prev_close = candles[i - 1]["close"]
         tr = max(high - low, abs(high - prev_close), abs(low - prev_close))
         trs.append(tr)
-    return float(sum(trs[-period:]) / period)
+    return float(sum(trs) / period)
 
 def rsi(closes: list, period: int = 14) -> list:
     if len(closes) < period + 1:
         return []
-    deltas = [closes[i + 1] - closes[i] for i in range(len(closes) - 1)]
-    gains = [max(delta, 0) for delta in deltas]
-    losses = [abs(min(delta, 0)) for delta in deltas]
+    # Split price changes into gains/losses in one pass over the closes
+    gains, losses = [], []
+    for prev, cur in zip(closes, closes[1:]):
+        delta = cur - prev
+        if delta > 0:
+            gains.append(delta)
+            losses.append(0)
+        else:
+            gains.append(0)
+            losses.append(-delta)
     avg_gain = sum(gains[:period]) / period
     avg_loss = sum(losses[:period]) / period
     rsis = [100 if avg_loss == 0 else 100 - (100 / (1 + (avg_gain / avg_loss)))]
@@ -138,10 +455,13 @@ def rsi(closes: list, period: int = 14) -> list:
 def ema_slope(closes: list, period: int = 10) -> float:
     if len(closes) < period + 2:
         return 0
-    series = pd.Series(closes)
-    ema_series = series.ewm(span=period, adjust=False).mean()
-    slope = ema_series.iloc[-1] - ema_series.iloc[-2]
-    return slope
+    # Same recursion as pd.Series.ewm(span=period, adjust=False), without building
+    # a Series for ~20 closes on every pair of every strength pass
+    alpha = 2 / (period + 1)
+    prev = ema_val = closes[0]
+    for price in closes[1:]:
+        prev, ema_val = ema_val, ema_val + alpha * (price - ema_val)
+    return ema_val - prev
 
 # ================= CURRENT PRICE =================
 def get_current_price(pair: str) -> float:
@@ -150,32 +470,111 @@ def get_current_price(pair: str) -> float:
         return candles[-1]["close"]
     return 0.0
 
+# ================= MARKET HOURS =================
+# Spot FX trades from Sunday 17:00 to Friday 17:00 New York time
+_NEW_YORK = pytz.timezone("America/New_York")
+
+_market_open_cache = (None, True)  # (minute tick, result) for clock-based calls
+
+def is_forex_market_open(now: datetime = None) -> bool:
+    """Return False over the weekend close, when every candle fetch is a guaranteed no-op."""
+    global _market_open_cache
+    if now is None:
+        # Answer changes at most on a minute boundary; skip the tz-aware datetime otherwise
+        tick = int(time.time() // 60)
+        if _market_open_cache[0] == tick:
+            return _market_open_cache[1]
+        result = _is_forex_market_open_at(datetime.now(pytz.utc))
+        _market_open_cache = (tick, result)
+        return result
+    return _is_forex_market_open_at(now)
+
+def _is_forex_market_open_at(now: datetime) -> bool:
+    ny = now.astimezone(_NEW_YORK)
+    weekday = ny.weekday()  # Monday=0 ... Sunday=6
+    if weekday == 5:
+        return False
+    if weekday == 4:
+        return ny.hour < 17
+    if weekday == 6:
+        return ny.hour >= 17
+    return True
+
+def seconds_until_market_open(now: datetime = None) -> float:
+    """Seconds until the Sunday 17:00 New York reopen; 0 while the market is open."""
+    if now is None:
+        now = datetime.now(pytz.utc)
+    if _is_forex_market_open_at(now):
+        return 0.0
+    ny = now.astimezone(_NEW_YORK)
+    reopen_day = ny.date() + timedelta(days=(6 - ny.weekday()) % 7)
+    reopen = _NEW_YORK.localize(datetime(reopen_day.year, reopen_day.month, reopen_day.day, 17))
+    return max(0.0, (reopen - now).total_seconds())
+
+# ================= ATOMIC JSON STATE =================
+def write_json_atomic(path: str, data) -> None:
+    """
+    Write JSON to a temp file, fsync it and os.replace() it over `path`,
+    so a crash mid-write never leaves a truncated state file behind.
+    Concurrent writers are serialized with an flock on `path`.lock (POSIX).
+    """
+    tmp_path = path + ".tmp"
+    with open(path + ".lock", "w") as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+def read_json_state(path: str):
+    """
+    Load JSON written by write_json_atomic().
+    Falls back to a leftover temp file if the main file is missing or corrupt.
+    Returns None when neither file exists.
+    """
+    last_error = None
+    for candidate in (path, path + ".tmp"):
+        if not os.path.exists(candidate):
+            continue
+        try:
+            with open(candidate, "r") as f:
+                return json.load(f)
+        except ValueError as e:
+            last_error = e
+    if last_error is not None:
+        raise last_error
+    return None
+
 # ================= ACTIVE TRADES JSON =================
 ACTIVE_TRADES_FILE = "active_trades.json"
 
 def load_active_trades():
-    if not os.path.exists(ACTIVE_TRADES_FILE):
-        return []
     try:
-        with open(ACTIVE_TRADES_FILE, "r") as f:
-            return json.load(f)
+        return read_json_state(ACTIVE_TRADES_FILE) or []
     except Exception as e:
         logger.error(f"Failed to load active trades: {e}")
         return []
 
 def save_active_trades(trades):
     try:
-        with open(ACTIVE_TRADES_FILE, "w") as f:
-            json.dump(trades, f)
+        write_json_atomic(ACTIVE_TRADES_FILE, trades)
     except Exception as e:
         logger.error(f"Failed to save active trades: {e}")
 
 # ================= EMA CALCULATION =================
 def calculate_ema(prices: list, period: int = 20) -> float:
+    """Final EMA value (SMA-seeded); accepts a list or a float64 ndarray."""
     if len(prices) < period:
         return None
-    ema = sum(prices[:period]) / period
-    multiplier = 2 / (period + 1)
-    for price in prices[period:]:
-        ema = (price - ema) * multiplier + ema
-    return ema
\ No newline at end of file
+    prices = np.asarray(prices, dtype=np.float64)
+    ema = float(prices[:period].sum()) / period
+    rest = prices[period:]
+    if not rest.size:
+        return ema
+    # The recurrence ema = price * k + ema * (1 - k), unrolled into one weighted
+    # dot product: the SMA seed decays by (1 - k)^n, price i by k * (1 - k)^(n-1-i)
+    decay = 1 - 2 / (period + 1)
+    weights = (1 - decay) * decay ** np.arange(rest.size - 1, -1, -1)
+    return float(decay ** rest.size * ema + weights @ rest)